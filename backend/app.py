@@ -1,152 +1,107 @@
 from flask import Flask, request, jsonify, send_file, g
 from flask_cors import CORS
-from service.database import get_pg
-from service.billing_service import get_billing_period, get_query_range_for_month
-from middleware.auth import require_auth
+from service.database import get_pg, get_pool_stats
+from service.async_database import get_async_pg, run_async, gather_queries
+from service.request_memo import memo_execute, memo_execute_async, memo_hits
+from service.billing_service import get_billing_periods, get_query_range_for_month, stamp_billing_periods, refresh_billing_periods
+from middleware.auth import require_auth, invalidate_identity, get_auth_cache_stats
+from middleware.conditional import conditional_get
 import pandas as pd
+import numpy as np
 import io
 import os
 import json
 import uuid
-from dateutil.parser import parse
+import base64
+import asyncio
 
 app = Flask(__name__)
 CORS(app) # Enable CORS for all routes
 
 # Fetch payment methods scoped to a family: global (family_id IS NULL) + family-specific.
 # Keeping this scoped prevents unrelated families' credit card closing days from
-# accidentally widening the expense query window in fetch_expenses_for_period().
+# accidentally widening the expense query window in get_expense_query_window().
 def get_payment_methods(family_id=None):
     client = get_pg()
     if family_id:
-        res = client.from_("payment_methods").select("*")\
-            .or_(f"family_id.is.null,family_id.eq.{family_id}").execute()
+        res = memo_execute(client.from_("payment_methods").select("*")\
+            .or_(f"family_id.is.null,family_id.eq.{family_id}"))
     else:
-        res = client.from_("payment_methods").select("*").is_("family_id", "null").execute()
+        res = memo_execute(client.from_("payment_methods").select("*").is_("family_id", "null"))
     # Return dict mapping id -> method
     return {pm['id']: pm for pm in res.data}
 
-from service.earnings_service import fetch_earnings_for_period, add_earning
-from service.investment_service import fetch_portfolio, add_investment, update_investment, delete_investment, get_portfolio_distribution_by_type
-from service.closing_day_service import get_closing_day_for_month, set_closing_day_for_month, delete_closing_day_for_month
-from datetime import timedelta, date
-
-# ============= RECURRING EXPENSES LOGIC =============
-
-def materialize_recurring_expenses(month, year, user_id):
-    """
-    Auto-generates expense records for active recurring definitions.
-    Only creates expenses for months on or after the template creation month.
-    """
-    client = get_pg()
-    
-    # Get all active recurring expenses for this user
-    recurring_defs = client.from_("recurring_expenses")\
-        .select("*")\
-        .eq("user_id", user_id)\
-        .eq("active", True)\
-        .execute().data
-        
-    if not recurring_defs:
-        return
-    
-    # Get existing materialized expenses for this period to avoid duplicates
-    start_date, end_date = get_query_range_for_month(month, year)
-    query_end = end_date + timedelta(days=1)
-    
-    existing_expenses = client.from_("expenses")\
-        .select("id, recurring_id, spent_at")\
-        .eq("user_id", user_id)\
-        .not_.is_("recurring_id", "null")\
-        .gte("spent_at", start_date.isoformat())\
-        .lt("spent_at", query_end.isoformat())\
-        .execute().data
-    
-    # Map recurring_id -> list of spent_at dates already created
-    created_map = {}
-    for exp in existing_expenses:
-        rid = exp['recurring_id']
-        if rid not in created_map:
-            created_map[rid] = []
-        created_map[rid].append(parse(exp['spent_at']).date())
-    
-    # Process each recurring definition
-    for rdef in recurring_defs:
-        rid = rdef['id']
-        day = rdef['day_of_month'] or 1
-        
-        print(f"[DEBUG] Processing recurring '{rdef.get('description')}' (id={rid}, day={day}) for {month}/{year}")
-
-        # Calculate target date, handling end-of-month edge cases
-        try:
-            target_date = date(year, month, day)
-        except ValueError:
-            # Handle cases like Feb 31 -> Feb 28/29
-            import calendar
-            last_day = calendar.monthrange(year, month)[1]
-            target_date = date(year, month, min(day, last_day))
-        
-        print(f"[DEBUG] Target date: {target_date}")
+async def get_payment_methods_async(family_id=None):
+    client = get_async_pg()
+    if family_id:
+        res = await memo_execute_async(client.from_("payment_methods").select("*")\
+            .or_(f"family_id.is.null,family_id.eq.{family_id}"))
+    else:
+        res = await memo_execute_async(client.from_("payment_methods").select("*").is_("family_id", "null"))
+    return {pm['id']: pm for pm in res.data}
 
-        # Don't backdate: only allow expenses for the creation month or later.
-        # e.g. created on March 20 with day_of_month=5 → March 5 IS allowed (same month).
-        created_at_date = parse(rdef['created_at']).date()
-        print(f"[DEBUG] Created at: {created_at_date}")
+from service.earnings_service import fetch_earnings_for_period_async, add_earning
+from service.quote_cache import get_quote_cache_stats, get_quote_fetch_metrics
+from service.price_refresher import get_price_refresher_status
+from service.investment_service import fetch_portfolio, portfolio_price_epoch, get_portfolio_cache_stats, add_investment, update_investment, delete_investment, get_portfolio_distribution_by_type
+from service.closing_day_service import (
+    get_closing_day_for_month, get_closing_day_for_month_async, set_closing_day_for_month, delete_closing_day_for_month,
+    get_closing_day_cache_stats,
+)
+from service.recurring_service import (
+    materialize_recurring_for_scope, materialize_recurring_for_family_range, invalidate_materialization_watermarks,
+)
+from service.scheduler import start_scheduler, get_run_log
+from service.rollups import get_reconcile_log
+from service.data_version import get_data_version
+from service.dashboard_cache import (
+    dashboard_cache_key, get_cached_dashboard, store_dashboard, expense_periods,
+    invalidate_dashboard_periods, invalidate_dashboard_family, get_dashboard_cache_stats,
+)
+from datetime import timedelta, date
+from dateutil.relativedelta import relativedelta
+from dateutil.parser import parse
 
-        created_month_start = date(created_at_date.year, created_at_date.month, 1)
-        if target_date < created_month_start:
-            print(f"[DEBUG] SKIPPING: Target {target_date} is before creation month {created_month_start}")
-            continue
-        
-        # Check if already materialized for this month
-        already_created = False
-        if rid in created_map:
-            for dt in created_map[rid]:
-                # We check strict month match for materialization to avoid duplicates in same month
-                if dt.month == month and dt.year == year:
-                    already_created = True
-                    print(f"[DEBUG] SKIPPING: Already created for this month on {dt}")
-                    break
-        
-        if not already_created:
-            # Double-check with a fresh DB query to prevent duplicates from concurrent requests
-            month_start = date(year, month, 1)
-            if month == 12:
-                month_end = date(year + 1, 1, 1)
-            else:
-                month_end = date(year, month + 1, 1)
-            existing = client.from_("expenses")\
-                .select("id", count="exact")\
-                .eq("recurring_id", rid)\
-                .gte("spent_at", month_start.isoformat())\
-                .lt("spent_at", month_end.isoformat())\
-                .execute()
-            if existing.data and len(existing.data) > 0:
-                print(f"[DEBUG] SKIPPING: Fresh DB check found existing expense for {rid} in {month}/{year}")
-                continue
-
-            print(f"[DEBUG] MATERIALIZING: Creating expense for {target_date}")
-            # Create the expense
-            new_exp = {
-                "user_id": user_id,
-                "amount": rdef['amount'],
-                "category_key": rdef['category_key'],
-                "payment_method_id": rdef['payment_method_id'],
-                "spent_at": target_date.isoformat(),
-                "recurring_id": rid,
-                "comment": f"Recurring: {rdef['description'] or ''}".strip()
-            }
-            try:
-                client.from_("expenses").insert(new_exp).execute()
-            except Exception as e:
-                print(f"[ERROR] Failed to materialize recurring {rid} for {target_date}: {e}")
+# Pre-materialize recurring expenses ahead of each month (enable on one process only)
+if os.environ.get('PREMATERIALIZE_SCHEDULER', '').lower() in ('1', 'true', 'yes'):
+    start_scheduler()
 
-# =====================================================
+@app.after_request
+def add_dedup_debug_header(response):
+    # Debug aid: how many PostgREST reads this request served from the request memo
+    if app.debug or os.environ.get('PG_MEMO_DEBUG_HEADER'):
+        response.headers['X-PG-Deduplicated'] = str(memo_hits())
+    return response
 
 @app.route('/health', methods=['GET'])
 def health():
     return jsonify({"status": "ok"})
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Cache and pool counters for capacity planning. The run logs name families,
+    users and symbols, so the endpoint is off unless METRICS_TOKEN is set and
+    the request sends it as X-Metrics-Token.
+    """
+    metrics_token = os.environ.get('METRICS_TOKEN')
+    if not metrics_token:
+        return jsonify({"error": "Metrics disabled"}), 404
+    if request.headers.get('X-Metrics-Token') != metrics_token:
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify({
+        "auth": get_auth_cache_stats(),
+        "pg_pool": get_pool_stats(),
+        "closing_day_calendar": get_closing_day_cache_stats(),
+        "dashboard_cache": get_dashboard_cache_stats(),
+        "quote_cache": get_quote_cache_stats(),
+        "quote_fetch": get_quote_fetch_metrics(),
+        "portfolio_cache": get_portfolio_cache_stats(),
+        "price_refresher": get_price_refresher_status(),
+        "prematerialize_runs": get_run_log(),
+        "rollup_reconcile_runs": get_reconcile_log(),
+    })
+
 RELEASES_DIR = os.environ.get('RELEASES_DIR', os.path.join(os.path.dirname(__file__), 'releases'))
 
 @app.route('/app/version', methods=['GET'])
@@ -174,6 +129,7 @@ def download_apk():
 # FAMILY DATA ENDPOINT
 @app.route('/family/data', methods=['GET'])
 @require_auth
+@conditional_get()
 def get_family_data():
     """Returns profiles, categories, and payment methods scoped to the authenticated family."""
     client = get_pg()
@@ -215,6 +171,7 @@ def get_family_data():
 
 @app.route('/categories', methods=['GET'])
 @require_auth
+@conditional_get()
 def list_categories():
     """Full category list for the management UI — includes is_global and is_hidden flags."""
     if not g.family_id:
@@ -331,7 +288,9 @@ def create_expense():
         data['family_id'] = g.family_id
     try:
         client = get_pg()
+        stamp_billing_periods([data])
         res = client.from_("expenses").insert(data).execute()
+        invalidate_dashboard_periods(g.family_id, expense_periods([data['spent_at']]))
         return jsonify(res.data[0] if res.data else {}), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -361,7 +320,9 @@ def create_expenses_bulk():
             item['installment_group_id'] = group_id
     try:
         client = get_pg()
+        stamp_billing_periods(items)
         res = client.from_("expenses").insert(items).execute()
+        invalidate_dashboard_periods(g.family_id, expense_periods(item.get('spent_at') for item in items))
         return jsonify(res.data), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -376,6 +337,19 @@ def update_expense(expense_id):
         return jsonify({"error": "No valid fields to update"}), 400
     try:
         client = get_pg()
+        previous_spent_at = None
+        if 'spent_at' in update_data or 'payment_method_id' in update_data:
+            # The billing period depends on both; fill in whichever is not changing.
+            # The old date is also needed to invalidate the period the expense leaves.
+            current = client.from_("expenses").select("spent_at, payment_method_id")\
+                .eq("id", expense_id).eq("family_id", g.family_id).execute().data
+            if not current:
+                return jsonify({"error": "Expense not found or unauthorized"}), 404
+            previous_spent_at = current[0]['spent_at']
+            period_row = {**current[0], **update_data}
+            stamp_billing_periods([period_row])
+            update_data['billing_month'] = period_row['billing_month']
+            update_data['billing_year'] = period_row['billing_year']
         res = client.from_("expenses")\
             .update(update_data)\
             .eq("id", expense_id)\
@@ -383,6 +357,7 @@ def update_expense(expense_id):
             .execute()
         if not res.data:
             return jsonify({"error": "Expense not found or unauthorized"}), 404
+        invalidate_dashboard_periods(g.family_id, expense_periods([res.data[0].get('spent_at'), previous_spent_at]))
         return jsonify(res.data[0]), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -390,6 +365,7 @@ def update_expense(expense_id):
 # INVESTMENTS ENDPOINTS
 @app.route('/investments', methods=['GET'])
 @require_auth
+@conditional_get(extra=portfolio_price_epoch)
 def get_investments():
     try:
         portfolio = fetch_portfolio(g.profile_id, family_id=g.family_id)
@@ -421,7 +397,7 @@ def edit_investment(inv_id):
         allowed = ['quantity', 'cost_basis', 'name', 'symbol', 'type', 'currency']
         updates = {k: v for k, v in data.items() if k in allowed}
 
-        res = update_investment(inv_id, g.profile_id, updates)
+        res = update_investment(inv_id, g.profile_id, updates, family_id=g.family_id)
         return jsonify(res)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -430,7 +406,7 @@ def edit_investment(inv_id):
 @require_auth
 def remove_investment(inv_id):
     try:
-        res = delete_investment(inv_id, g.profile_id)
+        res = delete_investment(inv_id, g.profile_id, family_id=g.family_id)
         return jsonify(res)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -452,18 +428,13 @@ def get_distribution():
         return jsonify({"error": str(e)}), 500
 
 
-# Helper function to fetch and filter expenses
-def fetch_expenses_for_period(month, year, user_id=None, closing_day_override=None, family_id=None):
+def get_expense_query_window(month, year, prev_month_override, closing_day_override, payment_methods):
+    """Returns the [start, end) spent_at window that covers every expense that can fall in this billing period."""
     # To build the correct query window, we need the PREVIOUS month's closing day.
     # Example: viewing March with default closing_day=23 would start the window at Feb 23.
     # But if February had a closing_day override of 20, an expense on Feb 20 belongs to
     # March (20 >= 20), yet would be missed because the window starts at Feb 23.
     # Fix: always use the previous month's closing day for the query window start.
-    from dateutil.relativedelta import relativedelta as _rd
-    prev_month_date = date(year, month, 1) - _rd(months=1)
-    prev_month_override = get_closing_day_for_month(prev_month_date.month, prev_month_date.year)
-    # Determine which closing day to use for the query range start (prev month's day)
-    # and for the billing-period assignment (current month's override or pm default)
     if prev_month_override is not None:
         query_closing_day = prev_month_override
     elif closing_day_override is not None:
@@ -474,7 +445,6 @@ def fetch_expenses_for_period(month, year, user_id=None, closing_day_override=No
     # Widen query window to account for credit cards with lower closing days.
     # Without this, expenses between a PM's closing_day and query_closing_day
     # in the previous month would never be fetched for the next billing period.
-    payment_methods = get_payment_methods(family_id=family_id)
     cc_closing_days = [
         pm.get('closing_day') or 23
         for pm in payment_methods.values()
@@ -488,112 +458,150 @@ def fetch_expenses_for_period(month, year, user_id=None, closing_day_override=No
     
     # Fix: Use .lt() with the start of the next day to include the entire end_date
     # This prevents excluding expenses on the last day of the month due to timestamp comparison
-    query_end = end_date + timedelta(days=1)
-    
-    client = get_pg()
-    # We need to fetch profiles(name) as well
+    return start_date, end_date + timedelta(days=1)
+
+
+# We need to fetch profiles(name) as well
+EXPENSE_SELECT = "*, categories(label), payment_methods(name, is_credit_card, closing_day), profiles(name)"
+
+
+def flatten_expense(exp):
+    """Flattens the embedded category/payment method/profile names for the API and report."""
+    flat_exp = exp.copy()
+    flat_exp['category_label'] = (exp.get('categories') or {}).get('label', 'Unknown')
+    flat_exp['payment_method_name'] = (exp.get('payment_methods') or {}).get('name', 'Unknown')
+    flat_exp['user_name'] = (exp.get('profiles') or {}).get('name', 'Unknown')
+    return flat_exp
+
+
+async def fetch_expenses_for_billing_period_async(month, year, user_id=None, family_id=None):
+    """Expenses whose stored billing period is month/year — an indexed equality filter, no post-filtering."""
+    query = get_async_pg().from_("expenses")\
+        .select(EXPENSE_SELECT)\
+        .eq("billing_month", month)\
+        .eq("billing_year", year)
+    if family_id:
+        query = query.eq("family_id", family_id)
+    elif user_id:
+        query = query.eq("user_id", user_id)
+    res = await query.execute()
+    return [flatten_expense(exp) for exp in res.data]
+
+
+async def fetch_expenses_in_window_async(start_date, query_end, user_id=None, family_id=None):
+    client = get_async_pg()
     query = client.from_("expenses")\
-        .select("*, categories(label), payment_methods(name, is_credit_card, closing_day), profiles(name)")\
+        .select(EXPENSE_SELECT)\
         .gte("spent_at", start_date.isoformat())\
         .lt("spent_at", query_end.isoformat())
-        
     if family_id:
-        # Family-scoped: materialize for all family members then filter by family_id
-        try:
-            family_users = client.from_("profiles").select("id").eq("family_id", family_id).execute().data
-            for user in family_users:
-                materialize_recurring_expenses(month, year, user['id'])
-        except Exception as e:
-            print(f"Error materializing for family: {e}")
         query = query.eq("family_id", family_id)
     elif user_id:
-        # Fallback: filter by specific user (for backwards compat / single-user case)
-        materialize_recurring_expenses(month, year, user_id)
         query = query.eq("user_id", user_id)
-    else:
-        # No filter - materialize for all users (should not happen in normal flow)
-        try:
-            all_users = client.from_("profiles").select("id").execute().data
-            for user in all_users:
-                materialize_recurring_expenses(month, year, user['id'])
-        except Exception as e:
-            print(f"Error materializing for all users: {e}")
-        
-    res = query.execute()
-    raw_expenses = res.data
-    
-    filtered = []
-    for exp in raw_expenses:
-        spent_at_date = parse(exp['spent_at']).date()
-        pm_info = exp.get('payment_methods') or {'name': 'Unknown', 'is_credit_card': False, 'closing_day': None}
-
-        # CRITICAL: The closing day used to assign billing period must come from the
-        # MONTH IN WHICH THE EXPENSE FALLS, not the month being viewed.
-        #
-        # Example: expense on Feb 20, February override=20 → belongs to March (20>=20).
-        # When viewing March (no override → pm_default=23):
-        #   Old wrong logic: 20 >= 23 → False → assigns to February (wrong!)
-        #   New correct logic: expense is in prev month → use prev_month_override=20 → 20>=20 → March ✓
-        #
-        # If the expense falls in the previous month, use that month's closing day override.
-        # If it falls in the current billing month, use the current month's closing day override.
-        exp_in_prev_month = (spent_at_date.month == prev_month_date.month and
-                             spent_at_date.year == prev_month_date.year)
-
-        if exp_in_prev_month:
-            # Use previous month's closing day (override if set, else pm default)
-            effective_closing_day = prev_month_override if prev_month_override is not None \
-                else pm_info.get('closing_day', 23) or 23
-        else:
-            # Use current viewing month's closing day (override if set, else pm default)
-            effective_closing_day = closing_day_override if closing_day_override is not None \
-                else pm_info.get('closing_day', 23) or 23
-
-        b_month, b_year = get_billing_period(
-            spent_at_date,
-            pm_info['is_credit_card'],
-            effective_closing_day
-        )
-        
-        if b_month == month and b_year == year:
-            # Flatten for report
-            flat_exp = exp.copy()
-            flat_exp['category_label'] = (exp.get('categories') or {}).get('label', 'Unknown')
-            flat_exp['payment_method_name'] = pm_info.get('name', 'Unknown')
-            flat_exp['user_name'] = (exp.get('profiles') or {}).get('name', 'Unknown')
-            filtered.append(flat_exp)
-            
-    return filtered
-
-@app.route('/dashboard', methods=['GET'])
-@require_auth
-def dashboard():
-    try:
-        month = int(request.args.get('month'))
-        year = int(request.args.get('year'))
-    except (TypeError, ValueError):
-        return jsonify({"error": "Missing or invalid month/year"}), 400
-
-    # Filter by family (shows all members); optional user_id narrows to one member
-    family_id = g.family_id
-    user_id = request.args.get('user_id')
+    res = await query.execute()
+    return res.data
+
+
+def filter_expenses_for_period(raw_expenses, month, year, prev_month_override=None, closing_day_override=None):
+    """Keeps the expenses whose billing period is month/year and flattens them for the API/report."""
+    if not raw_expenses:
+        return []
+    prev_month_date = date(year, month, 1) - relativedelta(months=1)
+
+    default_pm = {'name': 'Unknown', 'is_credit_card': False, 'closing_day': None}
+    pm_infos = [exp.get('payment_methods') or default_pm for exp in raw_expenses]
+    spent_at = pd.Series([exp['spent_at'] for exp in raw_expenses], dtype=object).astype(str).str.slice(0, 10)
+    is_credit_card = np.array([bool(pm['is_credit_card']) for pm in pm_infos])
+    pm_closing_days = np.array([pm.get('closing_day') or 23 for pm in pm_infos])
+
+    # CRITICAL: The closing day used to assign billing period must come from the
+    # MONTH IN WHICH THE EXPENSE FALLS, not the month being viewed.
+    #
+    # Example: expense on Feb 20, February override=20 → belongs to March (20>=20).
+    # When viewing March (no override → pm_default=23):
+    #   Old wrong logic: 20 >= 23 → False → assigns to February (wrong!)
+    #   New correct logic: expense is in prev month → use prev_month_override=20 → 20>=20 → March ✓
+    #
+    # If the expense falls in the previous month, use that month's closing day override.
+    # If it falls in the current billing month, use the current month's closing day override.
+    # Either way, fall back to the payment method's closing day when there is no override.
+    exp_in_prev_month = spent_at.str.startswith(f"{prev_month_date.year:04d}-{prev_month_date.month:02d}").to_numpy()
+    prev_closing_days = pm_closing_days if prev_month_override is None else prev_month_override
+    current_closing_days = pm_closing_days if closing_day_override is None else closing_day_override
+    effective_closing_days = np.where(exp_in_prev_month, prev_closing_days, current_closing_days)
+
+    b_months, b_years = get_billing_periods(spent_at, is_credit_card, effective_closing_days)
+    in_period = (b_months == month) & (b_years == year)
+
+    return [flatten_expense(exp) for exp, keep in zip(raw_expenses, in_period) if keep]
+
+
+async def fetch_expenses_with_closing_day_async(month, year, closing_day, user_id=None, family_id=None):
+    """
+    Legacy path for an ad-hoc ?closing_day= with no override saved for the month:
+    stored billing periods don't reflect it, so re-derive them from a widened date window.
+    """
+    prev_month_date = date(year, month, 1) - relativedelta(months=1)
+    prev_month_override, payment_methods = await gather_queries(
+        get_closing_day_for_month_async(prev_month_date.month, prev_month_date.year),
+        get_payment_methods_async(family_id=family_id),
+    )
+    start_date, query_end = get_expense_query_window(month, year, prev_month_override, closing_day, payment_methods)
+    [raw_expenses] = await gather_queries(
+        fetch_expenses_in_window_async(start_date, query_end, user_id=user_id, family_id=family_id)
+    )
+    return filter_expenses_for_period(raw_expenses, month, year, prev_month_override, closing_day)
 
-    # Check for month-specific closing day override in database
-    db_override = get_closing_day_for_month(month, year)
 
-    # Optional closing day override from query parameter (for backwards compatibility)
-    closing_day_arg = request.args.get('closing_day')
-    query_override = int(closing_day_arg) if closing_day_arg and closing_day_arg.strip() else None
+async def fetch_period_async(month, year, user_id=None, family_id=None, closing_day_param=None):
+    """
+    Loads a billing period's expenses and earnings concurrently. The expenses
+    query runs after materialization so it sees freshly created recurring rows.
+    Returns (expenses, earnings).
+    """
+    async def materialized_expenses():
+        await asyncio.to_thread(materialize_recurring_for_scope, month, year, user_id, family_id)
+        if closing_day_param is not None:
+            # A saved override always wins over the query parameter (and matches the stored periods)
+            [db_override] = await gather_queries(get_closing_day_for_month_async(month, year))
+            if db_override is None:
+                return await fetch_expenses_with_closing_day_async(month, year, closing_day_param, user_id, family_id)
+        return await fetch_expenses_for_billing_period_async(month, year, user_id, family_id)
+
+    expenses, earnings = await gather_queries(
+        materialized_expenses(),
+        fetch_earnings_for_period_async(month, year, user_id, family_id=family_id),
+    )
+    return expenses, earnings
 
-    # Priority: database override > query parameter override > None (will use default 23)
-    closing_day = db_override if db_override is not None else query_override
 
-    expenses = fetch_expenses_for_period(month, year, user_id, closing_day_override=closing_day, family_id=family_id)
-    earnings = fetch_earnings_for_period(month, year, user_id, family_id=family_id)
-    
-    total_spent = sum(float(e['amount']) for e in expenses)
-    total_earned = sum(float(e['amount']) for e in earnings)
-    
+async def fetch_period_summary_async(month, year, user_id=None, family_id=None):
+    """
+    Totals and breakdowns for a billing period, aggregated in Postgres by the
+    dashboard_summary RPC so no expense/earning rows are transferred.
+    Materialization still runs first so recurring expenses are counted.
+    """
+    await asyncio.to_thread(materialize_recurring_for_scope, month, year, user_id, family_id)
+    [res] = await gather_queries(get_async_pg().rpc("dashboard_summary", {
+        "p_month": month,
+        "p_year": year,
+        "p_family_id": family_id,
+        "p_user_id": user_id,
+    }).execute())
+    summary = res.data or {}
+    return {
+        "total_spent": float(summary.get("total_spent") or 0),
+        "total_earned": float(summary.get("total_earned") or 0),
+        "category_breakdown": summary.get("category_breakdown") or {},
+        "user_spend_breakdown": summary.get("user_spend_breakdown") or {},
+        "user_earned_breakdown": summary.get("user_earned_breakdown") or {},
+        "expense_count": summary.get("expense_count") or 0,
+        "earning_count": summary.get("earning_count") or 0,
+    }
+
+
+def summarize_period(expenses, earnings):
+    """Same totals and breakdowns as dashboard_summary, computed from already-fetched rows."""
     category_totals = {}
     user_spend_totals = {}
     user_earned_totals = {}
@@ -606,24 +614,277 @@ def dashboard():
         # User Breakdown
         u_name = e['user_name']
         user_spend_totals[u_name] = user_spend_totals.get(u_name, 0.0) + amt
-            
+
     for e in earnings:
         amt = float(e['amount'])
         u_name = e['user_name']
         user_earned_totals[u_name] = user_earned_totals.get(u_name, 0.0) + amt
 
-    return jsonify({
-        "billing_period": f"{month}/{year}",
-        "total_spent": total_spent,
-        "total_earned": total_earned,
+    return {
+        "total_spent": sum(float(e['amount']) for e in expenses),
+        "total_earned": sum(float(e['amount']) for e in earnings),
         "category_breakdown": category_totals,
         "user_spend_breakdown": user_spend_totals,
         "user_earned_breakdown": user_earned_totals,
         "expense_count": len(expenses),
-        "expenses": expenses,
         "earning_count": len(earnings),
-        "earnings": earnings
-    })
+    }
+
+
+def _uses_stored_periods(month, year, closing_day_param):
+    # The stored billing periods (and the rollups built on them) apply unless an
+    # ad-hoc closing_day is requested for a month without a saved override
+    return closing_day_param is None or get_closing_day_for_month(month, year) is not None
+
+
+def _closing_day_param():
+    # Optional closing day override from query parameter (for backwards compatibility)
+    closing_day_arg = request.args.get('closing_day')
+    return int(closing_day_arg) if closing_day_arg and closing_day_arg.strip() else None
+
+@app.route('/dashboard', methods=['GET'])
+@require_auth
+@conditional_get()
+def dashboard():
+    try:
+        month = int(request.args.get('month'))
+        year = int(request.args.get('year'))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Missing or invalid month/year"}), 400
+
+    # Filter by family (shows all members); optional user_id narrows to one member
+    family_id = g.family_id
+    user_id = request.args.get('user_id')
+
+    closing_day_param = _closing_day_param()
+    summary_only = request.args.get('summary', '').lower() in ('1', 'true', 'yes')
+
+    # Keyed by the data version the ETag was built from (memoized for this request),
+    # so a hit is always the body for that ETag. Without a version, don't cache.
+    try:
+        data_version = get_data_version(family_id) if family_id else None
+    except Exception as e:
+        print(f"[WARN] Data version lookup failed, skipping dashboard cache: {e}")
+        data_version = None
+    cache_key = None
+    if data_version is not None:
+        cache_key = dashboard_cache_key(family_id, month, year, user_id, closing_day_param, summary_only, data_version)
+        cached, cache_token = get_cached_dashboard(cache_key)
+        if cached is not None:
+            return jsonify(cached)
+
+    # ?summary=true: totals and breakdowns only, aggregated in Postgres. Rows are
+    # fetched only when the client needs them (the default, for existing clients)
+    # or when an ad-hoc closing_day param means stored billing periods don't apply.
+    if summary_only and _uses_stored_periods(month, year, closing_day_param):
+        summary = run_async(fetch_period_summary_async(month, year, user_id, family_id=family_id))
+        response = {"billing_period": f"{month}/{year}", **summary}
+        if cache_key:
+            store_dashboard(cache_key, response, cache_token)
+        return jsonify(response)
+
+    expenses, earnings = run_async(fetch_period_async(
+        month, year, user_id, family_id=family_id, closing_day_param=closing_day_param
+    ))
+    response = {"billing_period": f"{month}/{year}", **summarize_period(expenses, earnings)}
+    if not summary_only:
+        response["expenses"] = expenses
+        response["earnings"] = earnings
+    if cache_key:
+        store_dashboard(cache_key, response, cache_token)
+    return jsonify(response)
+
+DASHBOARD_RANGE_MAX_MONTHS = 24
+
+
+def _months_between(start_month, start_year, end_month, end_year):
+    """Number of months from start to end, inclusive (0 or less when end is before start)."""
+    if not (1 <= start_month <= 12 and 1 <= end_month <= 12):
+        raise ValueError("month out of range")
+    return (end_year * 12 + end_month) - (start_year * 12 + start_month) + 1
+
+
+def _periods_between(start_month, start_year, end_month, end_year):
+    """Every (month, year) from start to end, inclusive."""
+    periods = []
+    current = date(start_year, start_month, 1)
+    last = date(end_year, end_month, 1)
+    while current <= last:
+        periods.append((current.month, current.year))
+        current += relativedelta(months=1)
+    return periods
+
+
+def summarize_rollup(rows):
+    """Same totals and breakdowns as summarize_period, from dashboard_rollup rows of one period."""
+    summary = summarize_period([], [])
+    for r in rows:
+        amt = float(r['total'])
+        if r['kind'] == 'expense':
+            summary['total_spent'] += amt
+            summary['expense_count'] += r['row_count']
+            lbl = r['category_label']
+            summary['category_breakdown'][lbl] = summary['category_breakdown'].get(lbl, 0.0) + amt
+            breakdown = summary['user_spend_breakdown']
+        else:
+            summary['total_earned'] += amt
+            summary['earning_count'] += r['row_count']
+            breakdown = summary['user_earned_breakdown']
+        breakdown[r['user_name']] = breakdown.get(r['user_name'], 0.0) + amt
+    return summary
+
+
+async def fetch_range_async(periods, user_id=None, family_id=None):
+    """
+    Per-month totals and breakdowns for consecutive billing periods, read from
+    the monthly rollups in one call (rows per period ~ categories x members).
+    Returns a list in period order.
+    """
+    (start_month, start_year), (end_month, end_year) = periods[0], periods[-1]
+
+    def materialize_all():
+        if family_id:
+            # One watermark query for the whole range; only unmarked months do any work
+            try:
+                materialize_recurring_for_family_range(periods, family_id)
+            except Exception as e:
+                print(f"Error materializing for family: {e}")
+            return
+        for month, year in periods:
+            materialize_recurring_for_scope(month, year, user_id, family_id)
+    await asyncio.to_thread(materialize_all)
+
+    [res] = await gather_queries(get_async_pg().rpc("dashboard_rollup", {
+        "p_start_month": start_month,
+        "p_start_year": start_year,
+        "p_end_month": end_month,
+        "p_end_year": end_year,
+        "p_family_id": family_id,
+        "p_user_id": user_id,
+    }).execute())
+
+    rows_by_period = {period: [] for period in periods}
+    for r in res.data or []:
+        rows_by_period.get((r['billing_month'], r['billing_year']), []).append(r)
+
+    return [
+        {"billing_period": f"{month}/{year}", **summarize_rollup(rows_by_period[(month, year)])}
+        for month, year in periods
+    ]
+
+
+@app.route('/dashboard/range', methods=['GET'])
+@require_auth
+@conditional_get()
+def dashboard_range():
+    """
+    Per-month dashboard totals from start_month/start_year to end_month/end_year
+    (inclusive, at most DASHBOARD_RANGE_MAX_MONTHS), e.g. for a yearly chart.
+    Read from the monthly rollups; no row lists are returned.
+    """
+    if not g.family_id:
+        return jsonify({"error": "Family context required"}), 400
+    try:
+        start_month = int(request.args.get('start_month'))
+        start_year = int(request.args.get('start_year'))
+        end_month = int(request.args.get('end_month'))
+        end_year = int(request.args.get('end_year'))
+        month_count = _months_between(start_month, start_year, end_month, end_year)
+    except (TypeError, ValueError):
+        return jsonify({"error": "Missing or invalid start_month/start_year/end_month/end_year"}), 400
+    if month_count < 1:
+        return jsonify({"error": "End period is before start period"}), 400
+    # Checked before building the period list, so huge ranges cost nothing
+    if month_count > DASHBOARD_RANGE_MAX_MONTHS:
+        return jsonify({"error": f"At most {DASHBOARD_RANGE_MAX_MONTHS} months per request"}), 400
+    try:
+        periods = _periods_between(start_month, start_year, end_month, end_year)
+    except ValueError:
+        return jsonify({"error": "Missing or invalid start_month/start_year/end_month/end_year"}), 400
+
+    try:
+        months = run_async(fetch_range_async(periods, request.args.get('user_id'), family_id=g.family_id))
+        return jsonify({
+            "start": f"{start_month}/{start_year}",
+            "end": f"{end_month}/{end_year}",
+            "total_spent": sum(m["total_spent"] for m in months),
+            "total_earned": sum(m["total_earned"] for m in months),
+            "months": months,
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+EXPENSE_PAGE_SIZE = 50
+EXPENSE_PAGE_MAX = 200
+
+
+def _encode_expense_cursor(row):
+    # Opaque to clients: the (spent_at, id) of the last row on the page
+    raw = json.dumps([row['spent_at'], row['id']]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_expense_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    spent_at, expense_id = json.loads(raw)
+    return spent_at, expense_id
+
+
+@app.route('/expenses', methods=['GET'])
+@require_auth
+def list_expenses():
+    """
+    Keyset-paginated expense listing, newest first (spent_at DESC, id DESC).
+    Optional filters: month+year (billing period), category_key, payment_method_id, user_id.
+    Pass the returned next_cursor as ?cursor= to get the following page; it is null on the last page.
+    """
+    if not g.family_id:
+        return jsonify({"error": "Family context required"}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', EXPENSE_PAGE_SIZE)), 1), EXPENSE_PAGE_MAX)
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+
+    month = request.args.get('month')
+    year = request.args.get('year')
+    if bool(month) != bool(year):
+        return jsonify({"error": "month and year must be given together"}), 400
+
+    query = get_pg().from_("expenses")\
+        .select(EXPENSE_SELECT)\
+        .eq("family_id", g.family_id)
+    try:
+        if month:
+            month, year = int(month), int(year)
+            materialize_recurring_for_scope(month, year, family_id=g.family_id)
+            query = query.eq("billing_month", month).eq("billing_year", year)
+        cursor = request.args.get('cursor')
+        if cursor:
+            spent_at, expense_id = _decode_expense_cursor(cursor)
+            query = query.or_(
+                f'spent_at.lt."{spent_at}",and(spent_at.eq."{spent_at}",id.lt."{expense_id}")'
+            )
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid month/year or cursor"}), 400
+
+    for field in ('category_key', 'payment_method_id', 'user_id'):
+        if request.args.get(field):
+            query = query.eq(field, request.args.get(field))
+
+    try:
+        # One extra row tells us whether another page exists
+        rows = query.order("spent_at", desc=True)\
+            .order("id", desc=True)\
+            .limit(limit + 1)\
+            .execute().data
+        page = rows[:limit]
+        return jsonify({
+            "expenses": [flatten_expense(exp) for exp in page],
+            "next_cursor": _encode_expense_cursor(page[-1]) if len(rows) > limit else None,
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
 @app.route('/earnings', methods=['POST'])
 @require_auth
@@ -645,6 +906,8 @@ def create_earning():
             data['earned_at'],
             family_id=g.family_id
         )
+        earned_on = parse(str(data['earned_at'])).date()
+        invalidate_dashboard_periods(g.family_id, {(earned_on.month, earned_on.year)})
         return jsonify(new_earning), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -684,6 +947,7 @@ def delete_expense(expense_id):
                 else:
                     del_q = del_q.eq("user_id", g.profile_id)
                 res = del_q.execute()
+                invalidate_dashboard_periods(g.family_id, expense_periods(r.get('spent_at') for r in res.data or []))
                 return jsonify({
                     "message": "Installments deleted successfully",
                     "deleted_count": len(res.data or [])
@@ -700,6 +964,7 @@ def delete_expense(expense_id):
         if not res.data:
             return jsonify({"error": "Expense not found or not authorised"}), 404
 
+        invalidate_dashboard_periods(g.family_id, expense_periods(r.get('spent_at') for r in res.data))
         return jsonify({"message": "Expense deleted successfully"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -738,6 +1003,8 @@ def create_recurring():
     try:
         client = get_pg()
         res = client.from_("recurring_expenses").insert(data).execute()
+        invalidate_materialization_watermarks(g.family_id)
+        invalidate_dashboard_family(g.family_id)
         return jsonify(res.data[0]), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -754,6 +1021,7 @@ def update_recurring(rid):
         read_only = {'id', 'created_at', 'family_id'}
         update_payload = {k: v for k, v in data.items() if k not in read_only}
         client.from_("recurring_expenses").update(update_payload).eq("id", rid).eq("family_id", g.family_id).execute()
+        invalidate_materialization_watermarks(g.family_id)
         # Fetch the updated record separately since .select() after .eq() is not supported
         updated_res = client.from_("recurring_expenses").select("*").eq("id", rid).eq("family_id", g.family_id).execute()
         updated_recurring = updated_res.data[0] if updated_res.data else None
@@ -783,14 +1051,6 @@ def update_recurring(rid):
             print(f"[DEBUG] Expense Updates payload: {expense_updates}")
             
             if expense_updates:
-                 # Check what we are targeting
-                 target_check = client.from_("expenses")\
-                     .select("id, spent_at")\
-                     .eq("recurring_id", rid)\
-                     .gte("spent_at", cutoff_date.isoformat())\
-                     .execute()
-                 print(f"[DEBUG] Target expenses found: {len(target_check.data) if target_check.data else 0}")
-
                  client.from_("expenses")\
                      .update(expense_updates)\
                      .eq("recurring_id", rid)\
@@ -798,26 +1058,20 @@ def update_recurring(rid):
                      .execute()
                  print(f"[DEBUG] Expenses update executed.")
 
-            # If day_of_month changed, update spent_at of future materialized expenses
+            # If day_of_month changed, re-date future materialized expenses server-side
+            # in one statement (end-of-month clamping happens in the SQL function)
             if 'day_of_month' in data:
-                import calendar
-                new_day = data['day_of_month']
-                future_expenses = client.from_("expenses")\
-                    .select("id, spent_at")\
-                    .eq("recurring_id", rid)\
-                    .gte("spent_at", cutoff_date.isoformat())\
-                    .execute().data or []
-
-                print(f"[DEBUG] Updating spent_at for {len(future_expenses)} expenses to day {new_day}")
-                for exp in future_expenses:
-                    old_date = parse(exp['spent_at']).date()
-                    last_day = calendar.monthrange(old_date.year, old_date.month)[1]
-                    safe_day = min(new_day, last_day)
-                    new_date = old_date.replace(day=safe_day)
-                    client.from_("expenses")\
-                        .update({"spent_at": new_date.isoformat()})\
-                        .eq("id", exp['id'])\
-                        .execute()
+                shifted = client.rpc("shift_recurring_expense_day", {
+                    "p_recurring_id": rid,
+                    "p_new_day": int(data['day_of_month']),
+                    "p_from": cutoff_date.isoformat(),
+                }).execute()
+                print(f"[DEBUG] Moved {shifted.data} expenses to day {data['day_of_month']}")
+
+            # Payment method and day both feed the billing period of the moved rows
+            if 'day_of_month' in data or 'payment_method_id' in data:
+                refresh_billing_periods(start=cutoff_date, recurring_id=rid)
+            invalidate_dashboard_family(g.family_id)
         else:
              print("[WARN] Update succeeded but returned no data? Check if ID exists or RLS.")
 
@@ -875,6 +1129,8 @@ def delete_recurring(rid):
         # 4. Delete the recurring definition
         print("[DEBUG] Deleting recurring definition...")
         client.from_("recurring_expenses").delete().eq("id", rid).execute()
+        invalidate_materialization_watermarks(g.family_id)
+        invalidate_dashboard_family(g.family_id)
         print("[DEBUG] Successfully deleted recurring definition")
         return jsonify({"message": "Deleted"}), 200
     except Exception as e:
@@ -899,17 +1155,17 @@ def monthly_report():
     user_id = request.args.get('user_id')
 
     # Use same closing day logic as dashboard so report matches what user sees
-    db_override = get_closing_day_for_month(month, year)
-    closing_day_arg = request.args.get('closing_day')
-    query_override = int(closing_day_arg) if closing_day_arg and closing_day_arg.strip() else None
-    closing_day = db_override if db_override is not None else query_override
+    closing_day_param = _closing_day_param()
+    expenses, earnings = run_async(fetch_period_async(
+        month, year, user_id, family_id=family_id, closing_day_param=closing_day_param
+    ))
+
+    # Summary sheet from the same rows as the detail sheets, so they always agree
+    summary = summarize_period(expenses, earnings)
 
-    expenses = fetch_expenses_for_period(month, year, user_id, closing_day_override=closing_day, family_id=family_id)
-    earnings = fetch_earnings_for_period(month, year, user_id, family_id=family_id)
-    
     # Calculate totals
-    total_spent = sum(float(e['amount']) for e in expenses)
-    total_earned = sum(float(e['amount']) for e in earnings)
+    total_spent = summary['total_spent']
+    total_earned = summary['total_earned']
     balance = total_earned - total_spent
     
     # Create DataFrames
@@ -964,34 +1220,34 @@ def monthly_report():
         summary_sheet.write(row, 1, balance, balance_format)
         
         # Category Breakdown
-        if not df_exp.empty and 'category_label' in df_exp.columns:
+        if summary['category_breakdown']:
             row += 2
             summary_sheet.merge_range(row, 0, row, 1, 'Spending by Category', header_format)
             row += 1
-            category_totals = df_exp.groupby('category_label')['amount'].sum().sort_values(ascending=False)
-            for category, amount in category_totals.items():
+            category_totals = sorted(summary['category_breakdown'].items(), key=lambda kv: kv[1], reverse=True)
+            for category, amount in category_totals:
                 summary_sheet.write(row, 0, category)
                 summary_sheet.write(row, 1, float(amount), currency_format)
                 row += 1
         
         # User Breakdown
-        if not df_exp.empty and 'user_name' in df_exp.columns:
+        if summary['user_spend_breakdown']:
             row += 1
             summary_sheet.merge_range(row, 0, row, 1, 'Spending by User', header_format)
             row += 1
-            user_totals = df_exp.groupby('user_name')['amount'].sum().sort_values(ascending=False)
-            for user, amount in user_totals.items():
+            user_totals = sorted(summary['user_spend_breakdown'].items(), key=lambda kv: kv[1], reverse=True)
+            for user, amount in user_totals:
                 summary_sheet.write(row, 0, user)
                 summary_sheet.write(row, 1, float(amount), currency_format)
                 row += 1
         
         # Earnings by User
-        if not df_earn.empty and 'user_name' in df_earn.columns:
+        if summary['user_earned_breakdown']:
             row += 1
             summary_sheet.merge_range(row, 0, row, 1, 'Earnings by User', header_format)
             row += 1
-            user_earnings = df_earn.groupby('user_name')['amount'].sum().sort_values(ascending=False)
-            for user, amount in user_earnings.items():
+            user_earnings = sorted(summary['user_earned_breakdown'].items(), key=lambda kv: kv[1], reverse=True)
+            for user, amount in user_earnings:
                 summary_sheet.write(row, 0, user)
                 summary_sheet.write(row, 1, float(amount), currency_format)
                 row += 1
@@ -1089,6 +1345,8 @@ def set_closing_day_override():
             return jsonify({"error": f"Month {month}/{year} only has {last_day} days"}), 400
         
         result = set_closing_day_for_month(month, year, closing_day)
+        # Overrides are global: every family's dashboards for the affected periods
+        invalidate_dashboard_periods(None, expense_periods([date(year, month, 1)]))
         return jsonify(result), 200
     except ValueError:
         return jsonify({"error": "Invalid data types"}), 400
@@ -1109,6 +1367,7 @@ def delete_closing_day_override():
     deleted = delete_closing_day_for_month(month, year)
     
     if deleted:
+        invalidate_dashboard_periods(None, expense_periods([date(year, month, 1)]))
         return jsonify({"message": "Override deleted successfully"}), 200
     else:
         return jsonify({"message": "No override found for this month/year"}), 404
@@ -1159,6 +1418,9 @@ def onboard_user():
 
     # 4. Payment methods are global (family_id IS NULL in DB) — no seeding needed per family.
 
+    # The identity cached for this token predates the profile/family — drop it
+    invalidate_identity(g.user_id)
+
     return jsonify({
         "profile_id": profile['id'],
         "family_id": family['id']
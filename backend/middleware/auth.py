@@ -1,11 +1,43 @@
 import os
+import time
+import hashlib
 from functools import wraps
+import jwt
 from flask import request, jsonify, g
 from supabase import create_client
 from service.database import get_pg
+from service.cache import TTLCache
+
+# Token verification mode:
+#   "local"    — verify the JWT in-process only (signature, exp, aud, iss)
+#   "remote"   — always ask Supabase Auth (one network round trip per request)
+#   "fallback" — verify locally, fall back to Supabase Auth only when local
+#                verification is not possible (no secret configured, JWKS unreachable)
+AUTH_VERIFY_MODE = os.environ.get("AUTH_VERIFY_MODE", "fallback").lower()
+JWT_AUDIENCE = os.environ.get("SUPABASE_JWT_AUDIENCE", "authenticated")
+# Re-fetch the JWKS at most this often; an unknown `kid` always forces a refresh,
+# so rotated keys are picked up without a restart.
+JWKS_CACHE_SECONDS = int(os.environ.get("SUPABASE_JWKS_CACHE_SECONDS", "600"))
+
+# Verified tokens are cached (keyed by SHA-256 of the token) until their own `exp`
+TOKEN_CACHE_SIZE = int(os.environ.get("AUTH_TOKEN_CACHE_SIZE", "4096"))
+# auth user -> (profile_id, family_id). Users that are not onboarded yet are
+# cached briefly so a profile created elsewhere is picked up quickly.
+IDENTITY_CACHE_SIZE = int(os.environ.get("AUTH_IDENTITY_CACHE_SIZE", "10000"))
+IDENTITY_CACHE_TTL = int(os.environ.get("AUTH_IDENTITY_CACHE_TTL", "3600"))
+IDENTITY_NEGATIVE_TTL = 60
+
+_ASYMMETRIC_ALGORITHMS = ["RS256", "ES256", "EdDSA"]
 
 # Singleton Supabase client — created once, reused on every request
 _supabase_client = None
+_jwks_client = None
+
+# token hash -> {user_id, email, profile_id, family_id}
+_token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE)
+# auth user id -> {profile_id, family_id}
+_identity_cache = TTLCache(maxsize=IDENTITY_CACHE_SIZE, ttl=IDENTITY_CACHE_TTL)
+
 
 def _get_supabase():
     global _supabase_client
@@ -17,9 +49,112 @@ def _get_supabase():
     return _supabase_client
 
 
-# Per-user caches — profile_id and family_id never change, so we cache forever
-_profile_cache: dict = {}  # auth_user_id -> profile_id
-_family_cache: dict = {}   # auth_user_id -> family_id
+def _auth_base_url():
+    return os.environ.get("SUPABASE_URL", "").rstrip("/") + "/auth/v1"
+
+
+def _get_jwks_client():
+    global _jwks_client
+    if _jwks_client is None:
+        _jwks_client = jwt.PyJWKClient(
+            _auth_base_url() + "/.well-known/jwks.json",
+            cache_keys=True,
+            lifespan=JWKS_CACHE_SECONDS,
+        )
+    return _jwks_client
+
+
+class LocalVerificationUnavailable(Exception):
+    """Raised when the token cannot be checked in-process (as opposed to being invalid)."""
+
+
+def _verify_locally(token):
+    """
+    Verify a Supabase access token without calling the auth server.
+    Legacy projects sign with HS256 (SUPABASE_JWT_SECRET); projects using
+    asymmetric signing keys publish them on the JWKS endpoint.
+    Returns the decoded claims or raises jwt.InvalidTokenError.
+    """
+    alg = jwt.get_unverified_header(token).get("alg")
+    if alg == "HS256":
+        secret = os.environ.get("SUPABASE_JWT_SECRET")
+        if not secret:
+            raise LocalVerificationUnavailable("SUPABASE_JWT_SECRET is not set")
+        key, algorithms = secret, ["HS256"]
+    elif alg in _ASYMMETRIC_ALGORITHMS:
+        try:
+            key = _get_jwks_client().get_signing_key_from_jwt(token).key
+        except jwt.PyJWKClientConnectionError as e:
+            raise LocalVerificationUnavailable(str(e))
+        algorithms = [alg]
+    else:
+        raise jwt.InvalidAlgorithmError(f"Unsupported token algorithm: {alg}")
+
+    return jwt.decode(
+        token,
+        key,
+        algorithms=algorithms,
+        audience=JWT_AUDIENCE,
+        issuer=os.environ.get("SUPABASE_JWT_ISSUER") or _auth_base_url(),
+        options={"require": ["exp", "sub"]},
+    )
+
+
+def _verify_remotely(token):
+    user = _get_supabase().auth.get_user(token).user
+    if user is None:
+        raise jwt.InvalidTokenError("Supabase Auth rejected the token")
+    # The signature was vouched for by Supabase; read `exp` only to bound caching
+    exp = jwt.decode(token, options={"verify_signature": False}).get("exp")
+    return {"sub": user.id, "email": user.email, "exp": exp}
+
+
+def verify_token(token):
+    """Returns the token claims (at least `sub` and `email`) or raises jwt.InvalidTokenError."""
+    if AUTH_VERIFY_MODE == "remote":
+        return _verify_remotely(token)
+    try:
+        return _verify_locally(token)
+    except LocalVerificationUnavailable as e:
+        if AUTH_VERIFY_MODE != "fallback":
+            raise jwt.InvalidTokenError(str(e))
+        print(f"[WARN] Local JWT verification unavailable ({e}), falling back to Supabase Auth")
+        return _verify_remotely(token)
+
+
+def invalidate_identity(user_id):
+    """
+    Drops every cached identity for an auth user. Call after anything that
+    changes their profile or family membership (e.g. onboarding).
+    """
+    _identity_cache.pop(user_id)
+    _token_cache.discard_where(lambda _, identity: identity["user_id"] == user_id)
+
+
+def get_auth_cache_stats():
+    return {
+        "token_cache": _token_cache.stats(),
+        "identity_cache": _identity_cache.stats(),
+    }
+
+
+def _resolve_identity(claims):
+    user_id = claims["sub"]
+
+    ids = _identity_cache.get(user_id)
+    if ids is None:
+        res = get_pg().rpc("resolve_identity", {"p_auth_id": user_id}).execute()
+        row = res.data[0] if res.data else {}
+        ids = {"profile_id": row.get("profile_id"), "family_id": row.get("family_id")}
+        ttl = IDENTITY_CACHE_TTL if ids["profile_id"] and ids["family_id"] else IDENTITY_NEGATIVE_TTL
+        _identity_cache.set(user_id, ids, ttl=ttl)
+
+    return {
+        "user_id": user_id,
+        "email": claims.get("email") or "",
+        "profile_id": ids["profile_id"],
+        "family_id": ids["family_id"],
+    }
 
 
 def require_auth(f):
@@ -30,41 +165,26 @@ def require_auth(f):
             return jsonify({"error": "Missing auth token"}), 401
 
         token = auth_header[7:]
+        token_key = hashlib.sha256(token.encode()).hexdigest()
 
-        try:
-            supabase = _get_supabase()
-            response = supabase.auth.get_user(token)
-            user = response.user
-            if user is None:
+        identity = _token_cache.get(token_key)
+        if identity is None:
+            try:
+                claims = verify_token(token)
+            except Exception:
                 return jsonify({"error": "Invalid token"}), 401
-        except Exception:
-            return jsonify({"error": "Invalid token"}), 401
-
-        g.user_id = user.id
-        g.user_email = user.email or ""
-
-        client = get_pg()
-
-        if user.id not in _profile_cache:
-            profile_res = (
-                client.from_("profiles")
-                .select("id")
-                .eq("auth_id", user.id)
-                .execute()
-            )
-            _profile_cache[user.id] = profile_res.data[0]["id"] if profile_res.data else None
-
-        if user.id not in _family_cache:
-            family_res = (
-                client.from_("family_members")
-                .select("family_id")
-                .eq("user_id", user.id)
-                .execute()
-            )
-            _family_cache[user.id] = family_res.data[0]["family_id"] if family_res.data else None
-
-        g.profile_id = _profile_cache[user.id]
-        g.family_id = _family_cache[user.id]
+
+            identity = _resolve_identity(claims)
+            if claims.get("exp"):
+                expires_at = claims["exp"]
+                if not (identity["profile_id"] and identity["family_id"]):
+                    expires_at = min(expires_at, time.time() + IDENTITY_NEGATIVE_TTL)
+                _token_cache.set(token_key, identity, expires_at=expires_at)
+
+        g.user_id = identity["user_id"]
+        g.user_email = identity["email"]
+        g.profile_id = identity["profile_id"]
+        g.family_id = identity["family_id"]
 
         return f(*args, **kwargs)
 
@@ -0,0 +1,45 @@
+import hashlib
+from functools import wraps
+from flask import request, g, make_response
+from service.data_version import get_data_version
+
+
+def _make_etag(version, extra=None):
+    # Same family data + same caller + same URL => same body
+    parts = [
+        str(g.family_id), str(g.get("profile_id")), str(version), request.path,
+        repr(sorted(request.args.items(multi=True))), repr(extra),
+    ]
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()[:32]
+
+
+def conditional_get(extra=None):
+    """
+    Adds a weak ETag derived from the family's data version to 200 responses
+    and answers a matching If-None-Match with 304 before the view runs.
+    `extra` is an optional callable for inputs not covered by the data version
+    (e.g. market prices). Apply below @require_auth.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if not g.get("family_id"):
+                return f(*args, **kwargs)
+            try:
+                etag = _make_etag(get_data_version(g.family_id), extra() if extra else None)
+            except Exception as e:
+                print(f"[WARN] Data version lookup failed, serving without ETag: {e}")
+                return f(*args, **kwargs)
+
+            if request.if_none_match.contains_weak(etag):
+                response = make_response("", 304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            # Clients may keep the body but must revalidate before reusing it
+            response.headers["Cache-Control"] = "private, no-cache"
+            return response
+        return decorated
+    return decorator
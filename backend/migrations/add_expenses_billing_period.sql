@@ -0,0 +1,111 @@
+-- Migration: Store each expense's billing period
+-- Purpose: billing_month/billing_year are computed when an expense is written (the backend
+--          reuses billing_service.get_billing_period()), so period views are an indexed
+--          equality filter instead of a widened date window filtered in Python.
+--          The SQL below mirrors that rule for backfill, bulk recomputes and writes that
+--          bypass the backend.
+-- Date: 2026-10-17
+
+ALTER TABLE expenses ADD COLUMN IF NOT EXISTS billing_month INT CHECK (billing_month >= 1 AND billing_month <= 12);
+ALTER TABLE expenses ADD COLUMN IF NOT EXISTS billing_year INT;
+
+CREATE INDEX IF NOT EXISTS idx_expenses_family_billing ON expenses(family_id, billing_year, billing_month);
+CREATE INDEX IF NOT EXISTS idx_expenses_user_billing ON expenses(user_id, billing_year, billing_month);
+
+-- Billing period (first day of the billing month) of an expense.
+-- Credit card expenses on/after the closing day belong to the next month. The closing day is
+-- the override for the month the expense falls in, else the payment method's (default 23).
+CREATE OR REPLACE FUNCTION expense_billing_period(p_spent_at DATE, p_payment_method_id payment_methods.id%TYPE)
+RETURNS DATE
+LANGUAGE sql STABLE AS $$
+  SELECT CASE
+    WHEN COALESCE(pm.is_credit_card, false)
+         AND EXTRACT(DAY FROM p_spent_at) >= COALESCE(
+           (SELECT o.closing_day FROM closing_day_overrides o
+             WHERE o.month = EXTRACT(MONTH FROM p_spent_at) AND o.year = EXTRACT(YEAR FROM p_spent_at)
+             LIMIT 1),
+           pm.closing_day,
+           23)
+      THEN (date_trunc('month', p_spent_at) + INTERVAL '1 month')::date
+    ELSE date_trunc('month', p_spent_at)::date
+  END
+  FROM (SELECT 1) AS one
+  LEFT JOIN payment_methods pm ON pm.id = p_payment_method_id;
+$$;
+
+-- Recomputes stored billing periods for the expenses matching every non-NULL filter.
+-- Called after a closing-day override or a recurring definition changes; returns rows changed.
+CREATE OR REPLACE FUNCTION refresh_expense_billing_periods(
+  p_from DATE DEFAULT NULL,
+  p_to DATE DEFAULT NULL,
+  p_payment_method_id payment_methods.id%TYPE DEFAULT NULL,
+  p_recurring_id UUID DEFAULT NULL
+)
+RETURNS INTEGER
+LANGUAGE sql AS $$
+  WITH computed AS (
+    SELECT e.id, expense_billing_period(e.spent_at::date, e.payment_method_id) AS period
+    FROM expenses e
+    WHERE (p_from IS NULL OR e.spent_at >= p_from)
+      AND (p_to IS NULL OR e.spent_at < p_to)
+      AND (p_payment_method_id IS NULL OR e.payment_method_id = p_payment_method_id)
+      AND (p_recurring_id IS NULL OR e.recurring_id = p_recurring_id)
+  ), updated AS (
+    UPDATE expenses e
+    SET billing_month = EXTRACT(MONTH FROM c.period)::int,
+        billing_year = EXTRACT(YEAR FROM c.period)::int
+    FROM computed c
+    WHERE e.id = c.id
+      AND (e.billing_month IS DISTINCT FROM EXTRACT(MONTH FROM c.period)::int
+           OR e.billing_year IS DISTINCT FROM EXTRACT(YEAR FROM c.period)::int)
+    RETURNING 1
+  )
+  SELECT count(*)::int FROM updated;
+$$;
+
+-- Safety net for rows written without going through the backend
+CREATE OR REPLACE FUNCTION expenses_fill_billing_period() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+  period DATE;
+BEGIN
+  period := expense_billing_period(NEW.spent_at::date, NEW.payment_method_id);
+  NEW.billing_month := EXTRACT(MONTH FROM period)::int;
+  NEW.billing_year := EXTRACT(YEAR FROM period)::int;
+  RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_expenses_fill_billing_period ON expenses;
+CREATE TRIGGER trg_expenses_fill_billing_period
+  BEFORE INSERT ON expenses
+  FOR EACH ROW WHEN (NEW.billing_month IS NULL OR NEW.billing_year IS NULL)
+  EXECUTE FUNCTION expenses_fill_billing_period();
+
+-- Payment methods are edited outside the API; recompute their expenses when the closing day changes
+-- SECURITY DEFINER: a client's closing-day edit must recompute every expense on the
+-- payment method, not only the rows its RLS policies let it see
+CREATE OR REPLACE FUNCTION payment_methods_refresh_billing_periods() RETURNS trigger
+LANGUAGE plpgsql SECURITY DEFINER SET search_path = public AS $$
+BEGIN
+  PERFORM refresh_expense_billing_periods(NULL, NULL, NEW.id, NULL);
+  RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_payment_methods_refresh_billing_periods ON payment_methods;
+CREATE TRIGGER trg_payment_methods_refresh_billing_periods
+  AFTER UPDATE OF closing_day, is_credit_card ON payment_methods
+  FOR EACH ROW
+  WHEN (OLD.closing_day IS DISTINCT FROM NEW.closing_day OR OLD.is_credit_card IS DISTINCT FROM NEW.is_credit_card)
+  EXECUTE FUNCTION payment_methods_refresh_billing_periods();
+
+-- Rewrites expenses of every family: backend only
+REVOKE EXECUTE ON FUNCTION refresh_expense_billing_periods FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION refresh_expense_billing_periods TO service_role;
+
+-- Backfill existing rows
+SELECT refresh_expense_billing_periods();
+
+COMMENT ON COLUMN expenses.billing_month IS 'Billing month (1-12) the expense counts towards; see expense_billing_period()';
+COMMENT ON COLUMN expenses.billing_year IS 'Billing year the expense counts towards';
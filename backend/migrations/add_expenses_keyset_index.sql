@@ -0,0 +1,6 @@
+-- Migration: Index for keyset-paginated expense listing
+-- Purpose: GET /expenses pages through a family's expenses ordered by (spent_at DESC, id DESC);
+--          this index serves both the ordering and the "(spent_at, id) < cursor" predicate.
+-- Date: 2026-10-17
+
+CREATE INDEX IF NOT EXISTS idx_expenses_family_spent_at_id ON expenses(family_id, spent_at DESC, id DESC);
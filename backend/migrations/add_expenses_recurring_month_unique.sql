@@ -0,0 +1,25 @@
+-- Migration: Unique materialized expense per (recurring_id, month)
+-- Purpose: Let the database reject duplicate recurring materializations, so the backend
+--          can insert with ON CONFLICT DO NOTHING instead of checking first
+--          (see reproduce_bug.py for the race this closes).
+-- Date: 2026-10-17
+
+-- First day of the month the recurring expense was materialized for (NULL for regular expenses)
+ALTER TABLE expenses ADD COLUMN IF NOT EXISTS recurring_month DATE;
+
+UPDATE expenses
+SET recurring_month = date_trunc('month', spent_at)::date
+WHERE recurring_id IS NOT NULL AND recurring_month IS NULL;
+
+-- Remove duplicates left behind by the old check-then-insert race, keeping the oldest row
+DELETE FROM expenses e
+USING expenses keep
+WHERE e.recurring_id IS NOT NULL
+  AND e.recurring_id = keep.recurring_id
+  AND e.recurring_month = keep.recurring_month
+  AND (e.created_at, e.id) > (keep.created_at, keep.id);
+
+ALTER TABLE expenses
+  ADD CONSTRAINT unique_expenses_recurring_month UNIQUE (recurring_id, recurring_month);
+
+COMMENT ON COLUMN expenses.recurring_month IS 'Month (first day) a recurring expense was materialized for; NULL for regular expenses';
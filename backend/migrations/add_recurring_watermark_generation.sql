@@ -0,0 +1,74 @@
+-- Migration: Guard materialization watermarks with a per-family generation
+-- Purpose: A materialization run reads the family's recurring definitions, inserts the
+--          month's expenses and then records the watermark. A definition created or
+--          changed in between would otherwise be covered by that watermark without ever
+--          being materialized. Every recurring_expenses write now bumps the family's
+--          generation (and drops its watermarks); the watermark is only recorded when the
+--          generation still matches the one read before the definitions.
+-- Date: 2026-10-17
+
+CREATE TABLE IF NOT EXISTS recurring_definition_generations (
+  family_id UUID PRIMARY KEY REFERENCES families(id) ON DELETE CASCADE,
+  generation BIGINT NOT NULL DEFAULT 0,
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+ALTER TABLE recurring_definition_generations ENABLE ROW LEVEL SECURITY;
+
+-- SECURITY DEFINER: client writes to recurring_expenses must still bump and clear
+CREATE OR REPLACE FUNCTION recurring_definition_touch() RETURNS trigger
+LANGUAGE plpgsql SECURITY DEFINER SET search_path = public AS $$
+DECLARE
+  fam UUID;
+BEGIN
+  FOREACH fam IN ARRAY ARRAY[
+    CASE WHEN TG_OP <> 'DELETE' THEN NEW.family_id END,
+    CASE WHEN TG_OP <> 'INSERT' THEN OLD.family_id END
+  ] LOOP
+    CONTINUE WHEN fam IS NULL;
+    INSERT INTO recurring_definition_generations AS r (family_id, generation, updated_at)
+    VALUES (fam, 1, NOW())
+    ON CONFLICT (family_id) DO UPDATE
+      SET generation = r.generation + 1,
+          updated_at = NOW();
+    DELETE FROM recurring_materialization_watermarks WHERE family_id = fam;
+  END LOOP;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_recurring_expenses_generation ON recurring_expenses;
+CREATE TRIGGER trg_recurring_expenses_generation
+  AFTER INSERT OR UPDATE OR DELETE ON recurring_expenses
+  FOR EACH ROW EXECUTE FUNCTION recurring_definition_touch();
+
+-- Records the watermark only if no definition changed since p_generation was read.
+-- The row lock makes a concurrent definition write wait for (and then delete) it.
+CREATE OR REPLACE FUNCTION set_materialization_watermark(
+  p_family_id UUID, p_month INT, p_year INT, p_generation BIGINT
+)
+RETURNS BOOLEAN
+LANGUAGE plpgsql AS $$
+DECLARE
+  current_generation BIGINT;
+BEGIN
+  SELECT generation INTO current_generation
+  FROM recurring_definition_generations
+  WHERE family_id = p_family_id
+  FOR SHARE;
+
+  IF COALESCE(current_generation, 0) <> p_generation THEN
+    RETURN false;
+  END IF;
+
+  INSERT INTO recurring_materialization_watermarks (family_id, month, year)
+  VALUES (p_family_id, p_month, p_year)
+  ON CONFLICT (family_id, month, year) DO NOTHING;
+  RETURN true;
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION set_materialization_watermark(UUID, INT, INT, BIGINT) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION set_materialization_watermark(UUID, INT, INT, BIGINT) TO service_role;
+
+COMMENT ON TABLE recurring_definition_generations IS 'Per-family counter of recurring definition changes; guards materialization watermarks';
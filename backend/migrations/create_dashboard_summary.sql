@@ -0,0 +1,67 @@
+-- Migration: Create dashboard_summary() RPC
+-- Purpose: Aggregate a billing period's totals in Postgres so GET /dashboard?summary=true
+--          returns only totals and breakdowns instead of every expense/earning row.
+--          Expenses are matched on the stored billing_month/billing_year; earnings on the
+--          calendar month of earned_at. A family filter takes precedence over a user filter.
+-- Date: 2026-10-17
+
+CREATE OR REPLACE FUNCTION dashboard_summary(
+  p_month INT,
+  p_year INT,
+  p_family_id UUID DEFAULT NULL,
+  p_user_id UUID DEFAULT NULL
+)
+RETURNS JSON
+LANGUAGE sql STABLE AS $$
+  WITH exp AS (
+    SELECT e.amount,
+           COALESCE(c.label, 'Unknown') AS category_label,
+           COALESCE(p.name, 'Unknown') AS user_name
+    FROM expenses e
+    LEFT JOIN categories c ON c.key = e.category_key
+    LEFT JOIN profiles p ON p.id = e.user_id
+    WHERE e.billing_month = p_month
+      AND e.billing_year = p_year
+      AND CASE
+            WHEN p_family_id IS NOT NULL THEN e.family_id = p_family_id
+            WHEN p_user_id IS NOT NULL THEN e.user_id = p_user_id
+            ELSE true
+          END
+  ), earn AS (
+    SELECT er.amount,
+           COALESCE(p.name, 'Unknown') AS user_name
+    FROM earnings er
+    LEFT JOIN profiles p ON p.id = er.user_id
+    WHERE er.earned_at >= make_date(p_year, p_month, 1)
+      AND er.earned_at < make_date(p_year, p_month, 1) + INTERVAL '1 month'
+      AND CASE
+            WHEN p_family_id IS NOT NULL THEN er.family_id = p_family_id
+            WHEN p_user_id IS NOT NULL THEN er.user_id = p_user_id
+            ELSE true
+          END
+  )
+  SELECT json_build_object(
+    'total_spent', (SELECT COALESCE(sum(amount), 0) FROM exp),
+    'total_earned', (SELECT COALESCE(sum(amount), 0) FROM earn),
+    'expense_count', (SELECT count(*) FROM exp),
+    'earning_count', (SELECT count(*) FROM earn),
+    'category_breakdown', (
+      SELECT COALESCE(json_object_agg(category_label, total), '{}'::json)
+      FROM (SELECT category_label, sum(amount) AS total FROM exp GROUP BY category_label) t
+    ),
+    'user_spend_breakdown', (
+      SELECT COALESCE(json_object_agg(user_name, total), '{}'::json)
+      FROM (SELECT user_name, sum(amount) AS total FROM exp GROUP BY user_name) t
+    ),
+    'user_earned_breakdown', (
+      SELECT COALESCE(json_object_agg(user_name, total), '{}'::json)
+      FROM (SELECT user_name, sum(amount) AS total FROM earn GROUP BY user_name) t
+    )
+  );
+$$;
+
+COMMENT ON FUNCTION dashboard_summary(INT, INT, UUID, UUID) IS 'Totals and category/user breakdowns for one billing period';
+
+-- Takes any family id (or none, for every family): backend only
+REVOKE EXECUTE ON FUNCTION dashboard_summary(INT, INT, UUID, UUID) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION dashboard_summary(INT, INT, UUID, UUID) TO service_role;
@@ -0,0 +1,73 @@
+-- Migration: Per-family data version
+-- Purpose: A counter per family that increments on every write to data the API serves
+--          (expenses, earnings, recurring definitions, categories, payment methods,
+--          closing-day overrides, investments, members). GET endpoints derive their ETag
+--          from it, so an unchanged screen costs one primary-key read and a 304.
+--          Bumped by triggers, so writes that bypass the backend are covered too.
+-- Date: 2026-10-17
+
+CREATE TABLE IF NOT EXISTS family_data_versions (
+  family_id UUID PRIMARY KEY REFERENCES families(id) ON DELETE CASCADE,
+  version BIGINT NOT NULL DEFAULT 0,
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Only the triggers and the backend touch versions: RLS without policies keeps
+-- clients from reading or rewriting another family's ETag input
+ALTER TABLE family_data_versions ENABLE ROW LEVEL SECURITY;
+
+-- Increments one family's version, or every family's when p_family_id is NULL
+-- (global rows such as shared categories and closing-day overrides affect everyone).
+CREATE OR REPLACE FUNCTION bump_family_data_version(p_family_id UUID)
+RETURNS VOID
+LANGUAGE sql SECURITY DEFINER SET search_path = public AS $$
+  INSERT INTO family_data_versions (family_id, version, updated_at)
+  SELECT f.id, 1, NOW() FROM families f
+  WHERE p_family_id IS NULL OR f.id = p_family_id
+  ON CONFLICT (family_id) DO UPDATE
+    SET version = family_data_versions.version + 1,
+        updated_at = NOW();
+$$;
+
+-- Generic row trigger: bumps the old and new row's family (tables without a
+-- family_id column, or rows where it is NULL, bump every family).
+CREATE OR REPLACE FUNCTION family_data_version_touch() RETURNS trigger
+LANGUAGE plpgsql SECURITY DEFINER SET search_path = public AS $$
+DECLARE
+  fam_new TEXT := CASE WHEN TG_OP <> 'DELETE' THEN to_jsonb(NEW)->>'family_id' END;
+  fam_old TEXT := CASE WHEN TG_OP <> 'INSERT' THEN to_jsonb(OLD)->>'family_id' END;
+BEGIN
+  IF fam_new IS NULL AND fam_old IS NULL THEN
+    PERFORM bump_family_data_version(NULL);
+  ELSE
+    IF fam_new IS NOT NULL THEN
+      PERFORM bump_family_data_version(fam_new::uuid);
+    END IF;
+    IF fam_old IS NOT NULL AND fam_old IS DISTINCT FROM fam_new THEN
+      PERFORM bump_family_data_version(fam_old::uuid);
+    END IF;
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+DO $$
+DECLARE
+  t TEXT;
+BEGIN
+  FOREACH t IN ARRAY ARRAY[
+    'expenses', 'earnings', 'recurring_expenses', 'categories', 'family_category_hidden',
+    'payment_methods', 'closing_day_overrides', 'investments', 'family_members', 'profiles'
+  ] LOOP
+    EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_data_version ON %I', t, t);
+    EXECUTE format(
+      'CREATE TRIGGER trg_%s_data_version AFTER INSERT OR UPDATE OR DELETE ON %I '
+      'FOR EACH ROW EXECUTE FUNCTION family_data_version_touch()', t, t);
+  END LOOP;
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION bump_family_data_version(UUID) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION bump_family_data_version(UUID) TO service_role;
+
+COMMENT ON TABLE family_data_versions IS 'Monotonic per-family change counter used for API ETags';
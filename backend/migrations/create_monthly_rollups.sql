@@ -0,0 +1,230 @@
+-- Migration: Incrementally maintained monthly rollups
+-- Purpose: Running totals per (family, billing period, kind, category, user) for expenses
+--          and earnings, kept current by row triggers on both tables. Period summaries
+--          (dashboard_summary, dashboard_rollup) read these instead of scanning raw rows,
+--          so their cost grows with categories x members, not with the number of expenses.
+--          reconcile_monthly_rollups() compares them with the raw rows and can rebuild them.
+-- Date: 2026-10-17
+
+-- One transaction, so the lock keeps writes out until the triggers are installed
+-- and the table is backfilled (LOCK TABLE also fails outside a transaction block)
+BEGIN;
+
+LOCK TABLE expenses, earnings IN SHARE MODE;
+
+CREATE TABLE IF NOT EXISTS monthly_rollups (
+  id BIGSERIAL PRIMARY KEY,
+  family_id UUID,
+  billing_year INT NOT NULL,
+  billing_month INT NOT NULL CHECK (billing_month >= 1 AND billing_month <= 12),
+  kind TEXT NOT NULL CHECK (kind IN ('expense', 'earning')),
+  category_key TEXT,
+  user_id UUID,
+  total NUMERIC NOT NULL DEFAULT 0,
+  row_count INT NOT NULL DEFAULT 0,
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  CONSTRAINT monthly_rollups_key UNIQUE NULLS NOT DISTINCT
+    (family_id, billing_year, billing_month, kind, category_key, user_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_monthly_rollups_user_period ON monthly_rollups(user_id, billing_year, billing_month);
+
+-- Backend-only (service role): no policies, so API clients can neither read nor write it.
+-- Client writes to expenses/earnings still maintain it through the SECURITY DEFINER triggers.
+ALTER TABLE monthly_rollups ENABLE ROW LEVEL SECURITY;
+
+-- Adds a delta to one rollup row (creating it on first use)
+CREATE OR REPLACE FUNCTION monthly_rollup_apply(
+  p_family_id UUID, p_year INT, p_month INT, p_kind TEXT,
+  p_category_key TEXT, p_user_id UUID, p_amount NUMERIC, p_count INT
+)
+RETURNS VOID
+LANGUAGE sql SECURITY DEFINER SET search_path = public AS $$
+  INSERT INTO monthly_rollups AS r (family_id, billing_year, billing_month, kind, category_key, user_id, total, row_count)
+  VALUES (p_family_id, p_year, p_month, p_kind, p_category_key, p_user_id, p_amount, p_count)
+  ON CONFLICT ON CONSTRAINT monthly_rollups_key DO UPDATE
+    SET total = r.total + EXCLUDED.total,
+        row_count = r.row_count + EXCLUDED.row_count,
+        updated_at = NOW();
+$$;
+
+-- Expenses count towards their stored billing period (filled by the BEFORE INSERT
+-- trigger or the backend), so the AFTER trigger always sees the final period.
+CREATE OR REPLACE FUNCTION expenses_maintain_rollup() RETURNS trigger
+LANGUAGE plpgsql SECURITY DEFINER SET search_path = public AS $$
+BEGIN
+  IF TG_OP <> 'INSERT' AND OLD.billing_month IS NOT NULL AND OLD.billing_year IS NOT NULL THEN
+    PERFORM monthly_rollup_apply(OLD.family_id, OLD.billing_year, OLD.billing_month, 'expense',
+                                 OLD.category_key, OLD.user_id, -COALESCE(OLD.amount, 0), -1);
+  END IF;
+  IF TG_OP <> 'DELETE' AND NEW.billing_month IS NOT NULL AND NEW.billing_year IS NOT NULL THEN
+    PERFORM monthly_rollup_apply(NEW.family_id, NEW.billing_year, NEW.billing_month, 'expense',
+                                 NEW.category_key, NEW.user_id, COALESCE(NEW.amount, 0), 1);
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_expenses_rollup ON expenses;
+CREATE TRIGGER trg_expenses_rollup
+  AFTER INSERT OR DELETE OR UPDATE OF amount, billing_month, billing_year, category_key, user_id, family_id ON expenses
+  FOR EACH ROW EXECUTE FUNCTION expenses_maintain_rollup();
+
+-- Earnings count towards the calendar month they were earned in
+CREATE OR REPLACE FUNCTION earnings_maintain_rollup() RETURNS trigger
+LANGUAGE plpgsql SECURITY DEFINER SET search_path = public AS $$
+BEGIN
+  IF TG_OP <> 'INSERT' AND OLD.earned_at IS NOT NULL THEN
+    PERFORM monthly_rollup_apply(OLD.family_id, EXTRACT(YEAR FROM OLD.earned_at)::int, EXTRACT(MONTH FROM OLD.earned_at)::int,
+                                 'earning', NULL, OLD.user_id, -COALESCE(OLD.amount, 0), -1);
+  END IF;
+  IF TG_OP <> 'DELETE' AND NEW.earned_at IS NOT NULL THEN
+    PERFORM monthly_rollup_apply(NEW.family_id, EXTRACT(YEAR FROM NEW.earned_at)::int, EXTRACT(MONTH FROM NEW.earned_at)::int,
+                                 'earning', NULL, NEW.user_id, COALESCE(NEW.amount, 0), 1);
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_earnings_rollup ON earnings;
+CREATE TRIGGER trg_earnings_rollup
+  AFTER INSERT OR DELETE OR UPDATE OF amount, earned_at, user_id, family_id ON earnings
+  FOR EACH ROW EXECUTE FUNCTION earnings_maintain_rollup();
+
+-- What the rollups should contain, computed from the raw rows
+CREATE OR REPLACE VIEW monthly_rollups_actual AS
+  SELECT family_id, billing_year, billing_month, 'expense'::text AS kind, category_key::text AS category_key,
+         user_id, sum(COALESCE(amount, 0)) AS total, count(*)::int AS row_count
+  FROM expenses
+  WHERE billing_month IS NOT NULL AND billing_year IS NOT NULL
+  GROUP BY family_id, billing_year, billing_month, category_key, user_id
+  UNION ALL
+  SELECT family_id, EXTRACT(YEAR FROM earned_at)::int, EXTRACT(MONTH FROM earned_at)::int, 'earning'::text, NULL::text,
+         user_id, sum(COALESCE(amount, 0)), count(*)::int
+  FROM earnings
+  WHERE earned_at IS NOT NULL
+  GROUP BY family_id, EXTRACT(YEAR FROM earned_at), EXTRACT(MONTH FROM earned_at), user_id;
+
+-- Returns every rollup key whose total or count differs from the raw rows.
+-- With p_fix, also rebuilds the table from the raw rows (writes are blocked meanwhile).
+CREATE OR REPLACE FUNCTION reconcile_monthly_rollups(p_fix BOOLEAN DEFAULT false)
+RETURNS TABLE (
+  family_id UUID, billing_year INT, billing_month INT, kind TEXT, category_key TEXT, user_id UUID,
+  rollup_total NUMERIC, actual_total NUMERIC, rollup_count BIGINT, actual_count BIGINT
+)
+LANGUAGE plpgsql AS $$
+#variable_conflict use_column
+BEGIN
+  IF p_fix THEN
+    LOCK TABLE expenses, earnings IN SHARE MODE;
+  END IF;
+
+  RETURN QUERY
+    SELECT d.family_id, d.billing_year, d.billing_month, d.kind, d.category_key, d.user_id,
+           sum(d.rollup_total), sum(d.actual_total), sum(d.rollup_count), sum(d.actual_count)
+    FROM (
+      SELECT r.family_id, r.billing_year, r.billing_month, r.kind, r.category_key, r.user_id,
+             r.total AS rollup_total, 0::numeric AS actual_total, r.row_count::bigint AS rollup_count, 0::bigint AS actual_count
+      FROM monthly_rollups r
+      UNION ALL
+      SELECT a.family_id, a.billing_year, a.billing_month, a.kind, a.category_key, a.user_id,
+             0::numeric, a.total, 0::bigint, a.row_count::bigint
+      FROM monthly_rollups_actual a
+    ) d
+    GROUP BY d.family_id, d.billing_year, d.billing_month, d.kind, d.category_key, d.user_id
+    HAVING sum(d.rollup_total) <> sum(d.actual_total) OR sum(d.rollup_count) <> sum(d.actual_count);
+
+  IF p_fix THEN
+    DELETE FROM monthly_rollups;
+    INSERT INTO monthly_rollups (family_id, billing_year, billing_month, kind, category_key, user_id, total, row_count)
+      SELECT a.family_id, a.billing_year, a.billing_month, a.kind, a.category_key, a.user_id, a.total, a.row_count
+      FROM monthly_rollups_actual a;
+  END IF;
+END;
+$$;
+
+-- Rollup rows for consecutive billing periods, labelled for display.
+-- A family filter takes precedence over a user filter (as in the rest of the API).
+CREATE OR REPLACE FUNCTION dashboard_rollup(
+  p_start_month INT,
+  p_start_year INT,
+  p_end_month INT,
+  p_end_year INT,
+  p_family_id UUID DEFAULT NULL,
+  p_user_id UUID DEFAULT NULL
+)
+RETURNS TABLE (
+  billing_month INT, billing_year INT, kind TEXT, category_label TEXT, user_name TEXT,
+  total NUMERIC, row_count BIGINT
+)
+LANGUAGE sql STABLE AS $$
+  SELECT r.billing_month, r.billing_year, r.kind,
+         CASE WHEN r.kind = 'expense' THEN COALESCE(c.label, 'Unknown') END,
+         COALESCE(p.name, 'Unknown'),
+         sum(r.total), sum(r.row_count)::bigint
+  FROM monthly_rollups r
+  LEFT JOIN categories c ON c.key = r.category_key
+  LEFT JOIN profiles p ON p.id = r.user_id
+  WHERE r.billing_year BETWEEN p_start_year AND p_end_year
+    AND r.billing_year * 12 + r.billing_month BETWEEN p_start_year * 12 + p_start_month AND p_end_year * 12 + p_end_month
+    AND r.row_count <> 0
+    AND CASE
+          WHEN p_family_id IS NOT NULL THEN r.family_id = p_family_id
+          WHEN p_user_id IS NOT NULL THEN r.user_id = p_user_id
+          ELSE true
+        END
+  GROUP BY 1, 2, 3, 4, 5;
+$$;
+
+-- Same result as before, now read from the rollups
+CREATE OR REPLACE FUNCTION dashboard_summary(
+  p_month INT,
+  p_year INT,
+  p_family_id UUID DEFAULT NULL,
+  p_user_id UUID DEFAULT NULL
+)
+RETURNS JSON
+LANGUAGE sql STABLE AS $$
+  WITH r AS (
+    SELECT * FROM dashboard_rollup(p_month, p_year, p_month, p_year, p_family_id, p_user_id)
+  )
+  SELECT json_build_object(
+    'total_spent', (SELECT COALESCE(sum(total), 0) FROM r WHERE kind = 'expense'),
+    'total_earned', (SELECT COALESCE(sum(total), 0) FROM r WHERE kind = 'earning'),
+    'expense_count', (SELECT COALESCE(sum(row_count), 0) FROM r WHERE kind = 'expense'),
+    'earning_count', (SELECT COALESCE(sum(row_count), 0) FROM r WHERE kind = 'earning'),
+    'category_breakdown', (
+      SELECT COALESCE(json_object_agg(category_label, total), '{}'::json)
+      FROM (SELECT category_label, sum(total) AS total FROM r WHERE kind = 'expense' GROUP BY category_label) t
+    ),
+    'user_spend_breakdown', (
+      SELECT COALESCE(json_object_agg(user_name, total), '{}'::json)
+      FROM (SELECT user_name, sum(total) AS total FROM r WHERE kind = 'expense' GROUP BY user_name) t
+    ),
+    'user_earned_breakdown', (
+      SELECT COALESCE(json_object_agg(user_name, total), '{}'::json)
+      FROM (SELECT user_name, sum(total) AS total FROM r WHERE kind = 'earning' GROUP BY user_name) t
+    )
+  );
+$$;
+
+-- Backfill from existing rows
+DELETE FROM monthly_rollups;
+INSERT INTO monthly_rollups (family_id, billing_year, billing_month, kind, category_key, user_id, total, row_count)
+  SELECT family_id, billing_year, billing_month, kind, category_key, user_id, total, row_count
+  FROM monthly_rollups_actual;
+
+-- Cross-family totals and the rebuild are for the backend only, not for RPC calls
+-- with the anon key (dashboard_summary is redefined above, so it is covered here too)
+REVOKE EXECUTE ON FUNCTION monthly_rollup_apply(UUID, INT, INT, TEXT, TEXT, UUID, NUMERIC, INT) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION reconcile_monthly_rollups(BOOLEAN) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION dashboard_rollup(INT, INT, INT, INT, UUID, UUID) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION dashboard_summary(INT, INT, UUID, UUID) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION monthly_rollup_apply(UUID, INT, INT, TEXT, TEXT, UUID, NUMERIC, INT) TO service_role;
+GRANT EXECUTE ON FUNCTION reconcile_monthly_rollups(BOOLEAN) TO service_role;
+GRANT EXECUTE ON FUNCTION dashboard_rollup(INT, INT, INT, INT, UUID, UUID) TO service_role;
+GRANT EXECUTE ON FUNCTION dashboard_summary(INT, INT, UUID, UUID) TO service_role;
+
+COMMENT ON TABLE monthly_rollups IS 'Per-period expense/earning totals maintained by triggers; see reconcile_monthly_rollups()';
+
+COMMIT;
@@ -0,0 +1,19 @@
+-- Migration: Create recurring_materialization_watermarks table
+-- Purpose: Record that a family's recurring expenses are fully materialized for a month,
+--          so dashboard/report reads can skip materialization entirely.
+--          Rows are deleted by the backend whenever a recurring_expenses row changes.
+-- Date: 2026-10-17
+
+CREATE TABLE IF NOT EXISTS recurring_materialization_watermarks (
+  family_id UUID NOT NULL REFERENCES families(id) ON DELETE CASCADE,
+  month INT NOT NULL CHECK (month >= 1 AND month <= 12),
+  year INT NOT NULL CHECK (year >= 2000),
+  completed_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  PRIMARY KEY (family_id, month, year)
+);
+
+-- Written by the backend only: RLS without policies keeps clients from inserting a
+-- fake watermark (which would stop the family's recurring expenses materializing)
+ALTER TABLE recurring_materialization_watermarks ENABLE ROW LEVEL SECURITY;
+
+COMMENT ON TABLE recurring_materialization_watermarks IS 'Months whose recurring expenses are fully materialized, per family';
@@ -0,0 +1,20 @@
+-- Migration: Create resolve_identity() RPC
+-- Purpose: Resolve an auth user's profile_id and family_id in a single round trip
+--          (used by the auth middleware on identity cache misses)
+-- Date: 2026-10-17
+
+CREATE INDEX IF NOT EXISTS idx_family_members_user ON family_members(user_id);
+
+CREATE OR REPLACE FUNCTION resolve_identity(p_auth_id UUID)
+RETURNS TABLE (profile_id UUID, family_id UUID)
+LANGUAGE sql STABLE AS $$
+  SELECT
+    (SELECT p.id FROM profiles p WHERE p.auth_id = p_auth_id LIMIT 1),
+    (SELECT fm.family_id FROM family_members fm WHERE fm.user_id = p_auth_id LIMIT 1);
+$$;
+
+-- Maps any auth id to its profile and family: backend (auth middleware) only
+REVOKE EXECUTE ON FUNCTION resolve_identity(UUID) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION resolve_identity(UUID) TO service_role;
+
+COMMENT ON FUNCTION resolve_identity(UUID) IS 'Returns (profile_id, family_id) for an auth user; NULLs if not onboarded';
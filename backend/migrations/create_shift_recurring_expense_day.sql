@@ -0,0 +1,29 @@
+-- Migration: Create shift_recurring_expense_day() RPC
+-- Purpose: Move every materialized expense of a recurring definition (from a cutoff date on)
+--          to a new day of month in one statement, clamping to the last day of short months
+--          (e.g. day 31 -> Feb 28/29). Called by PUT /recurring-expenses/<id>.
+-- Date: 2026-10-17
+
+CREATE OR REPLACE FUNCTION shift_recurring_expense_day(p_recurring_id UUID, p_new_day INT, p_from DATE)
+RETURNS INTEGER
+LANGUAGE sql AS $$
+  WITH shifted AS (
+    UPDATE expenses
+    SET spent_at = date_trunc('month', spent_at)::date + (
+          LEAST(
+            p_new_day,
+            EXTRACT(DAY FROM date_trunc('month', spent_at) + INTERVAL '1 month - 1 day')::int
+          ) - 1
+        )
+    WHERE recurring_id = p_recurring_id
+      AND spent_at >= p_from
+    RETURNING 1
+  )
+  SELECT count(*)::int FROM shifted;
+$$;
+
+-- Re-dates any family's expenses: backend only
+REVOKE EXECUTE ON FUNCTION shift_recurring_expense_day(UUID, INT, DATE) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION shift_recurring_expense_day(UUID, INT, DATE) TO service_role;
+
+COMMENT ON FUNCTION shift_recurring_expense_day(UUID, INT, DATE) IS 'Re-dates future materialized expenses of a recurring definition; returns rows updated';
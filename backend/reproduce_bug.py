@@ -8,7 +8,7 @@ import time
 sys.path.append(os.getcwd())
 
 from service.database import get_pg
-from app import materialize_recurring_expenses
+from service.recurring_service import materialize_recurring_expenses
 
 def test_duplication_bug():
     print("--- Starting Reproduction Test ---")
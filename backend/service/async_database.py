@@ -0,0 +1,62 @@
+import os
+import asyncio
+import threading
+import httpx
+from postgrest import AsyncPostgrestClient
+from service.database import connection_settings, http_client_options
+
+# Per-query deadline for awaitables run through gather_queries()
+PG_QUERY_TIMEOUT = float(os.environ.get("PG_QUERY_TIMEOUT", "15"))
+
+# One event loop per process, running in a daemon thread. Flask views stay
+# synchronous and hand coroutines to it with run_async(); the async client and
+# its connection pool live on this loop so they survive across requests.
+_loop = None
+_loop_lock = threading.Lock()
+_client = None
+
+
+def _get_loop():
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="pg-async-loop", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def get_async_pg():
+    """Returns the process-wide AsyncPostgrestClient. Must be called from coroutines run via run_async()."""
+    global _client
+    if _client is None:
+        base_url, headers = connection_settings()
+        http_client = httpx.AsyncClient(base_url=base_url, headers=headers, **http_client_options())
+        _client = AsyncPostgrestClient(base_url, headers=headers, http_client=http_client)
+    return _client
+
+
+def run_async(coro, timeout=None):
+    """
+    Runs a coroutine on the shared loop and blocks until it finishes.
+    The caller's context variables (including flask.g) are visible to the coroutine.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result(timeout)
+
+
+async def gather_queries(*aws, timeout=PG_QUERY_TIMEOUT):
+    """Awaits independent queries concurrently, each bounded by `timeout` seconds."""
+    return await asyncio.gather(*(asyncio.wait_for(aw, timeout) for aw in aws))
+
+
+def _reset_after_fork():
+    global _loop, _loop_lock, _client
+    # The loop thread does not survive fork; start fresh in the child
+    _loop = None
+    _loop_lock = threading.Lock()
+    _client = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
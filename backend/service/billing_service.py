@@ -1,5 +1,10 @@
 from datetime import date, timedelta
 from dateutil.relativedelta import relativedelta
+import numpy as np
+import pandas as pd
+from service.database import get_pg
+from service.request_memo import memo_execute
+from service.closing_day_service import get_closing_days_for_year
 
 def get_billing_period(spent_at: date, is_credit_card: bool, closing_day: int = 23):
     """
@@ -22,6 +27,68 @@ def get_billing_period(spent_at: date, is_credit_card: bool, closing_day: int =
     
     return spent_at.month, spent_at.year
 
+def get_billing_periods(spent_at, is_credit_card, closing_days):
+    """
+    Vectorized get_billing_period() for many expenses at once.
+    
+    spent_at: dates or ISO date/timestamp strings (only the calendar date is used)
+    is_credit_card: booleans, one per expense
+    closing_days: ints, one per expense (or a single int for all)
+    
+    Returns (months, years) as numpy int arrays.
+    """
+    dates = pd.to_datetime(pd.Series(spent_at, dtype=object).astype(str).str.slice(0, 10), format="%Y-%m-%d")
+    day = dates.dt.day.to_numpy()
+    month = dates.dt.month.to_numpy()
+    year = dates.dt.year.to_numpy()
+    
+    # Credit card expenses on/after the closing day roll into the next month
+    rolls = np.asarray(is_credit_card, dtype=bool) & (day >= np.asarray(closing_days))
+    month_index = (month - 1) + rolls.astype(int)
+    return month_index % 12 + 1, year + month_index // 12
+
+def stamp_billing_periods(rows):
+    """
+    Sets billing_month/billing_year on expense rows about to be written, from
+    their spent_at and payment_method_id. The closing day is the override for
+    the month the expense falls in, else the payment method's (default 23) —
+    the same rule as the SQL expense_billing_period().
+    """
+    if not rows:
+        return rows
+    client = get_pg()
+
+    pm_ids = sorted({str(r['payment_method_id']) for r in rows if r.get('payment_method_id') is not None})
+    methods = {}
+    if pm_ids:
+        res = memo_execute(client.from_("payment_methods").select("id, is_credit_card, closing_day").in_("id", pm_ids))
+        methods = {str(pm['id']): pm for pm in res.data}
+
+    # Stored periods are never recomputed on their own, so read the overrides
+    # uncached: another worker may have changed one within the cache TTL.
+    calendars = {}
+    for row in rows:
+        spent_at = date.fromisoformat(str(row['spent_at'])[:10])
+        if spent_at.year not in calendars:
+            calendars[spent_at.year] = get_closing_days_for_year(spent_at.year, fresh=True)
+        override = calendars[spent_at.year].get(spent_at.month)
+        pm = methods.get(str(row.get('payment_method_id'))) or {}
+        closing_day = override if override is not None else (pm.get('closing_day') or 23)
+        row['billing_month'], row['billing_year'] = get_billing_period(spent_at, bool(pm.get('is_credit_card')), closing_day)
+    return rows
+
+def refresh_billing_periods(start=None, end=None, recurring_id=None):
+    """
+    Recomputes stored billing periods server-side for expenses with spent_at in
+    [start, end) and/or of one recurring definition. Returns the rows changed.
+    """
+    res = get_pg().rpc("refresh_expense_billing_periods", {
+        "p_from": start.isoformat() if start else None,
+        "p_to": end.isoformat() if end else None,
+        "p_recurring_id": recurring_id,
+    }).execute()
+    return res.data
+
 def get_query_range_for_month(billing_month: int, billing_year: int, closing_day: int = 23):
     """
     Returns the absolute min and max dates ensuring we cover all transactions 
@@ -1,17 +1,65 @@
-from datetime import datetime
+import os
+from datetime import datetime, date
+from dateutil.relativedelta import relativedelta
 from service.database import get_pg
+from service.async_database import get_async_pg
+from service.cache import TTLCache
+
+# In-process override calendar: year -> {month: closing_day}. Overrides are loaded a
+# whole year at a time and this process invalidates on every write; other workers
+# pick up changes once their cached year expires.
+CLOSING_DAY_CACHE_TTL = int(os.environ.get("CLOSING_DAY_CACHE_TTL", "300"))
+_calendar_cache = TTLCache(maxsize=64, ttl=CLOSING_DAY_CACHE_TTL)
+
+
+def _year_query(client, year: int):
+    return client.from_("closing_day_overrides").select("month, closing_day").eq("year", year)
+
+
+def _to_calendar(rows) -> dict:
+    return {row['month']: row['closing_day'] for row in rows or []}
+
+
+def get_closing_days_for_year(year: int, fresh: bool = False) -> dict:
+    """
+    All closing day overrides for a year as {month: closing_day} (one query per year, then cached).
+    fresh=True skips the cache, for values that get stored rather than just displayed.
+    """
+    calendar = None if fresh else _calendar_cache.get(year)
+    if calendar is None:
+        calendar = _to_calendar(_year_query(get_pg(), year).execute().data)
+        _calendar_cache.set(year, calendar)
+    return calendar
+
 
 def get_closing_day_for_month(month: int, year: int) -> int | None:
     """
     Get the closing day override for a specific month/year.
     Returns None if no override exists.
     """
-    client = get_pg()
-    res = client.from_("closing_day_overrides").select("closing_day").eq("month", month).eq("year", year).execute()
-    
-    if res.data and len(res.data) > 0:
-        return res.data[0]['closing_day']
-    return None
+    return get_closing_days_for_year(year).get(month)
+
+
+async def get_closing_day_for_month_async(month: int, year: int) -> int | None:
+    """Async variant of get_closing_day_for_month() for concurrent fetches."""
+    calendar = _calendar_cache.get(year)
+    if calendar is None:
+        res = await _year_query(get_async_pg(), year).execute()
+        calendar = _to_calendar(res.data)
+        _calendar_cache.set(year, calendar)
+    return calendar.get(month)
+
+
+def invalidate_closing_day_calendar(year: int | None = None) -> None:
+    """Drops the cached overrides for one year (or all years)."""
+    if year is None:
+        _calendar_cache.clear()
+    else:
+        _calendar_cache.pop(year)
+
+
+def get_closing_day_cache_stats() -> dict:
+    return _calendar_cache.stats()
 
 
 def set_closing_day_for_month(month: int, year: int, closing_day: int) -> dict:
@@ -36,6 +84,8 @@ def set_closing_day_for_month(month: int, year: int, closing_day: int) -> dict:
             "year": year,
             "closing_day": closing_day
         }).execute()
+    invalidate_closing_day_calendar(year)
+    _refresh_billing_periods_for_month(month, year)
     
     return res.data[0] if res.data else {}
 
@@ -47,4 +97,18 @@ def delete_closing_day_for_month(month: int, year: int) -> bool:
     """
     client = get_pg()
     client.from_("closing_day_overrides").delete().eq("month", month).eq("year", year).execute()
+    invalidate_closing_day_calendar(year)
+    _refresh_billing_periods_for_month(month, year)
     return True
+
+
+def _refresh_billing_periods_for_month(month: int, year: int) -> None:
+    """
+    An override only changes the billing period of expenses spent in its own month,
+    so recompute just those (server-side, see refresh_expense_billing_periods()).
+    """
+    month_start = date(year, month, 1)
+    get_pg().rpc("refresh_expense_billing_periods", {
+        "p_from": month_start.isoformat(),
+        "p_to": (month_start + relativedelta(months=1)).isoformat(),
+    }).execute()
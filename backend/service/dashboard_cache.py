@@ -0,0 +1,84 @@
+import os
+import threading
+from dateutil.parser import parse
+from dateutil.relativedelta import relativedelta
+from service.cache import TTLCache
+
+# Computed /dashboard responses, keyed by
+# (family_id, month, year, user_id, closing_day, summary, data_version).
+# The family data version (service.data_version) changes on every write, including
+# writes handled by another worker or made in the database, so a cached body is
+# never served under a newer ETag. Write endpoints still drop the periods they
+# touch to free the superseded entries early.
+DASHBOARD_CACHE_SIZE = int(os.environ.get("DASHBOARD_CACHE_SIZE", "1000"))
+DASHBOARD_CACHE_TTL = int(os.environ.get("DASHBOARD_CACHE_TTL", "300"))
+
+_dashboard_cache = TTLCache(maxsize=DASHBOARD_CACHE_SIZE, ttl=DASHBOARD_CACHE_TTL)
+
+# Bumped on every invalidation so a response computed while a write was in
+# flight is not stored afterwards. None is the "every family" generation.
+_generations = {}
+_generation_lock = threading.Lock()
+
+
+def dashboard_cache_key(family_id, month, year, user_id=None, closing_day=None, summary=False, data_version=None):
+    return (family_id, month, year, user_id, closing_day, summary, data_version)
+
+
+def _generation(family_id):
+    with _generation_lock:
+        return (_generations.get(None, 0), _generations.get(family_id, 0))
+
+
+def _bump_generation(family_id):
+    with _generation_lock:
+        _generations[family_id] = _generations.get(family_id, 0) + 1
+
+
+def get_cached_dashboard(key):
+    """Returns (response, token). Pass the token to store_dashboard() once the response is computed."""
+    token = _generation(key[0])
+    return _dashboard_cache.get(key), token
+
+
+def store_dashboard(key, response, token):
+    """Caches a computed response unless its family was invalidated since `token` was taken."""
+    if _generation(key[0]) == token:
+        _dashboard_cache.set(key, response)
+
+
+def expense_periods(spent_at_values):
+    """
+    Billing periods an expense on each date can fall in: its own month, or the
+    next one when it is on a credit card past the closing day.
+    """
+    periods = set()
+    for value in spent_at_values:
+        if not value:
+            continue
+        day = parse(str(value)).date().replace(day=1)
+        nxt = day + relativedelta(months=1)
+        periods.add((day.month, day.year))
+        periods.add((nxt.month, nxt.year))
+    return periods
+
+
+def invalidate_dashboard_periods(family_id, periods):
+    """Drops cached dashboards of the (month, year) periods; family_id=None means every family."""
+    periods = set(periods)
+    if not periods:
+        return 0
+    _bump_generation(family_id)
+    return _dashboard_cache.discard_where(
+        lambda key, _: (family_id is None or key[0] == family_id) and (key[1], key[2]) in periods
+    )
+
+
+def invalidate_dashboard_family(family_id):
+    """Drops every cached dashboard of the family (e.g. after a recurring definition changes)."""
+    _bump_generation(family_id)
+    return _dashboard_cache.discard_where(lambda key, _: key[0] == family_id)
+
+
+def get_dashboard_cache_stats():
+    return _dashboard_cache.stats()
@@ -0,0 +1,14 @@
+from service.database import get_pg
+from service.request_memo import memo_execute
+
+# Per-family data version, incremented by database triggers on every write to
+# data the API serves (see migrations/create_family_data_versions.sql).
+# Anything derived from a family's data can be keyed or tagged by it.
+
+
+def get_data_version(family_id):
+    """Current data version of the family; 0 if it has never been written to."""
+    res = memo_execute(get_pg().from_("family_data_versions")
+                       .select("version")
+                       .eq("family_id", family_id))
+    return res.data[0]["version"] if res.data else 0
@@ -1,21 +1,136 @@
 import os
+import threading
+import httpx
 from dotenv import load_dotenv
 from postgrest import SyncPostgrestClient
 
 # Load environment variables from .env file
 load_dotenv(os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env'))
 
-def get_pg():
+# Connection pool settings — one keep-alive pool shared by every get_pg() caller
+PG_POOL_SIZE = int(os.environ.get("PG_POOL_SIZE", "20"))
+PG_POOL_KEEPALIVE = int(os.environ.get("PG_POOL_KEEPALIVE", str(PG_POOL_SIZE)))
+PG_POOL_TIMEOUT = float(os.environ.get("PG_POOL_TIMEOUT", "5"))        # wait for a free connection
+PG_CONNECT_TIMEOUT = float(os.environ.get("PG_CONNECT_TIMEOUT", "5"))
+PG_READ_TIMEOUT = float(os.environ.get("PG_READ_TIMEOUT", "30"))
+PG_HTTP2 = os.environ.get("PG_HTTP2", "false").lower() in ("1", "true", "yes")
+
+_client = None
+_client_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {"requests": 0, "clients_created": 0}
+
+
+def _on_request(_request):
+    with _stats_lock:
+        _stats["requests"] += 1
+
+
+def connection_settings():
+    """Returns (base_url, headers) for the Supabase PostgREST endpoint."""
     url = os.environ.get("SUPABASE_URL")
     key = os.environ.get("SUPABASE_KEY")
-    
+
     if not url or not key:
         raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in .env file")
 
     # Ensure URL ends with /rest/v1
     base_url = url.rstrip("/") + "/rest/v1"
-    
-    return SyncPostgrestClient(base_url, headers={
+    headers = {
         "apikey": key,
         "Authorization": f"Bearer {key}",
-    })
+    }
+    return base_url, headers
+
+
+def http_client_options():
+    """Pool limits, timeouts and protocol settings shared by the sync and async clients."""
+    http2 = PG_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401 — optional, only needed for HTTP/2
+        except ImportError:
+            print("[WARN] PG_HTTP2 is set but the 'h2' package is not installed, using HTTP/1.1")
+            http2 = False
+
+    return {
+        "http2": http2,
+        "limits": httpx.Limits(
+            max_connections=PG_POOL_SIZE,
+            max_keepalive_connections=PG_POOL_KEEPALIVE,
+        ),
+        "timeout": httpx.Timeout(
+            PG_READ_TIMEOUT,
+            connect=PG_CONNECT_TIMEOUT,
+            pool=PG_POOL_TIMEOUT,
+        ),
+    }
+
+
+def _build_client():
+    base_url, headers = connection_settings()
+    http_client = httpx.Client(
+        base_url=base_url,
+        headers=headers,
+        event_hooks={"request": [_on_request]},
+        **http_client_options(),
+    )
+    with _stats_lock:
+        _stats["clients_created"] += 1
+    return SyncPostgrestClient(base_url, headers=headers, http_client=http_client)
+
+
+def get_pg():
+    """
+    Returns the process-wide PostgREST client. All callers share one
+    keep-alive connection pool, so repeated calls within a request reuse
+    open TLS connections instead of handshaking again.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _build_client()
+    return _client
+
+
+def reset_pg_pool():
+    """
+    Discards the shared client. Called automatically in forked children so a
+    pre-forking server never shares sockets inherited from the parent.
+    """
+    global _client, _client_lock, _stats_lock
+    _client = None
+    _client_lock = threading.Lock()
+    _stats_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_pg_pool)
+
+
+def get_pool_stats():
+    """Connection pool counters for /metrics: open/idle/in-use connections and queued requests."""
+    stats = {
+        "max_connections": PG_POOL_SIZE,
+        "max_keepalive": PG_POOL_KEEPALIVE,
+        "http2": PG_HTTP2,
+        **_stats,
+        "connections": 0,
+        "in_use": 0,
+        "idle": 0,
+        "waiting": 0,
+    }
+    client = _client
+    if client is None:
+        return stats
+    # httpcore does not expose pool state publicly; read it defensively
+    pool = getattr(getattr(client.session, "_transport", None), "_pool", None)
+    connections = list(getattr(pool, "connections", []) or [])
+    idle = sum(1 for c in connections if c.is_idle())
+    stats["connections"] = len(connections)
+    stats["idle"] = idle
+    stats["in_use"] = len(connections) - idle
+    pending = list(getattr(pool, "_requests", []) or [])
+    stats["waiting"] = sum(1 for r in pending if getattr(r, "connection", None) is None)
+    return stats
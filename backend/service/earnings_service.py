@@ -1,9 +1,8 @@
 from service.database import get_pg
+from service.async_database import get_async_pg
 from dateutil.parser import parse
 
-def fetch_earnings_for_period(month, year, user_id=None, family_id=None):
-    client = get_pg()
-
+def _earnings_query(client, month, year, user_id=None, family_id=None):
     start_date = f"{year}-{month:02d}-01"
     if month == 12:
         end_date = f"{year + 1}-01-01"
@@ -19,10 +18,9 @@ def fetch_earnings_for_period(month, year, user_id=None, family_id=None):
         query = query.eq("family_id", family_id)
     elif user_id:
         query = query.eq("user_id", user_id)
-        
-    res = query.execute()
-    data = res.data
-    
+    return query
+
+def _flatten_earnings(data):
     # Process if needed, e.g., flatten structure
     filtered = []
     for item in data:
@@ -32,6 +30,10 @@ def fetch_earnings_for_period(month, year, user_id=None, family_id=None):
         
     return filtered
 
+async def fetch_earnings_for_period_async(month, year, user_id=None, family_id=None):
+    res = await _earnings_query(get_async_pg(), month, year, user_id, family_id).execute()
+    return _flatten_earnings(res.data)
+
 def add_earning(user_id, amount, description, earned_at, family_id=None):
     client = get_pg()
     data = {
@@ -1,22 +1,106 @@
+import os
 import time
-import yfinance as yf
+import threading
 from service.database import get_pg
+from service.cache import SingleFlight
+from service.quote_cache import get_quotes, FX_RATE_SYMBOLS
+from service.price_refresher import ensure_price_refresher
+from service.data_version import get_data_version
 
+# cache key -> {'data', 'ts', 'version'}; an entry only serves requests at the
+# family data version it was computed from, so an edit on any worker retires it
 _portfolio_cache: dict = {}
 _PORTFOLIO_CACHE_TTL = 300  # 5 minutes
+# Past the TTL a cached portfolio is still served (marked stale) while one
+# background refresh runs; past this age callers wait for a fresh valuation.
+PORTFOLIO_MAX_STALENESS = int(os.environ.get("PORTFOLIO_MAX_STALENESS", "1800"))
+
+_portfolio_lock = threading.Lock()
+_refreshing = set()  # cache keys with a background refresh in flight
+_portfolio_generation: dict = {}  # cache key -> invalidation count
+# Concurrent valuations of the same portfolio (e.g. several family devices
+# opening the screen at once) share one computation
+_portfolio_flight = SingleFlight()
 
 def _invalidate_portfolio_cache(user_id, family_id=None):
     key = str(family_id) if family_id else str(user_id)
-    _portfolio_cache.pop(key, None)
+    with _portfolio_lock:
+        _portfolio_cache.pop(key, None)
+        _portfolio_generation[key] = _portfolio_generation.get(key, 0) + 1
+
+def _with_age(data, ts, stale):
+    return {**data, "stale": stale, "age_s": round(time.time() - ts, 1)}
+
+def _data_version(family_id):
+    # Memoized per request (the /investments ETag already read it)
+    if not family_id:
+        return None
+    try:
+        return get_data_version(family_id)
+    except Exception as e:
+        print(f"[WARN] Data version lookup failed for portfolio cache: {e}")
+        return None
+
+def _refresh_in_background(user_id, family_id, cache_key, version):
+    with _portfolio_lock:
+        if cache_key in _refreshing:
+            return
+        _refreshing.add(cache_key)
+
+    def run():
+        try:
+            _portfolio_flight.do((cache_key, version), _compute_portfolio, user_id, family_id, cache_key, version)
+        except Exception as e:
+            print(f"[WARN] Background portfolio refresh failed for key={cache_key}: {e}")
+        finally:
+            with _portfolio_lock:
+                _refreshing.discard(cache_key)
+
+    threading.Thread(target=run, name=f"portfolio-refresh-{cache_key}", daemon=True).start()
+
+def portfolio_price_epoch():
+    """Changes whenever cached prices may have been refreshed; part of the /investments ETag."""
+    return int(time.time() // _PORTFOLIO_CACHE_TTL)
 
 def fetch_portfolio(user_id, family_id=None):
+    """
+    Valued portfolio, with `stale` and `age_s` (seconds since valuation).
+    Stale-while-revalidate: a cached valuation older than the TTL but within
+    PORTFOLIO_MAX_STALENESS is returned at once and refreshed in the background.
+    """
     cache_key = str(family_id) if family_id else str(user_id)
+    version = _data_version(family_id)
     now = time.time()
     cached = _portfolio_cache.get(cache_key)
-    if cached and (now - cached['ts']) < _PORTFOLIO_CACHE_TTL:
-        print(f"[CACHE HIT] fetch_portfolio key={cache_key}")
-        return cached['data']
+    if cached and cached.get('version') == version:
+        age = now - cached['ts']
+        if age < _PORTFOLIO_CACHE_TTL:
+            print(f"[CACHE HIT] fetch_portfolio key={cache_key}")
+            return _with_age(cached['data'], cached['ts'], stale=False)
+        if age < PORTFOLIO_MAX_STALENESS:
+            print(f"[CACHE STALE] fetch_portfolio key={cache_key} age={age:.0f}s")
+            _refresh_in_background(user_id, family_id, cache_key, version)
+            return _with_age(cached['data'], cached['ts'], stale=True)
+
+    # Flights are per version too: a valuation begun before an edit is not shared after it
+    result = _portfolio_flight.do((cache_key, version), _compute_portfolio, user_id, family_id, cache_key, version)
+    return _with_age(result, now, stale=False)
+
+def get_portfolio_cache_stats():
+    return {
+        "size": len(_portfolio_cache),
+        "refreshing": len(_refreshing),
+        "in_flight": _portfolio_flight.in_flight(),
+        "coalesced_calls": _portfolio_flight.shared,
+    }
 
+def _compute_portfolio(user_id, family_id, cache_key, version=None):
+    """
+    Loads and values the portfolio, then caches it under `version` (the family
+    data version read before the investments) unless it was invalidated meanwhile.
+    """
+    with _portfolio_lock:
+        generation = _portfolio_generation.get(cache_key, 0)
     client = get_pg()
 
     # 1. Fetch investments from DB — prefer family_id scope, fall back to user_id
@@ -36,49 +120,12 @@ def fetch_portfolio(user_id, family_id=None):
 
     # 2. Collect symbols to fetch (Stocks/Crypto) plus Exchange Rates
     symbols = [inv['symbol'] for inv in investments if inv['type'] in ('stock', 'crypto') and inv['symbol']]
-    
-    # Exchange Rates needed:
-    # BRL=X -> USD to BRL (e.g. 5.15)
-    # EURUSD=X -> EUR to USD (e.g. 1.05)
-    # USDPLN=X -> USD to PLN (e.g. 3.95)
-    rates_map = {
-        'BRL': 'BRL=X',
-        'EUR': 'EURUSD=X',
-        'PLN': 'USDPLN=X'
-    }
-    
-    for r in rates_map.values():
-        symbols.append(r)
-    
-    # 3. Fetch current prices
-    prices = {}
-    if symbols:
-        tickers_str = " ".join(set(symbols)) # Unique
-        try:
-            data = yf.Tickers(tickers_str)
-            for sym in set(symbols):
-                try:
-                    ticker = data.tickers[sym]
-                    # Try fast_info first, then history
-                    price = 0.0
-                    if hasattr(ticker, 'fast_info'):
-                        # safe access
-                        try:
-                            price = ticker.fast_info['last_price']
-                        except:
-                            pass
-                    
-                    if price == 0.0:
-                        hist = ticker.history(period="1d")
-                        if not hist.empty:
-                            price = hist['Close'].iloc[-1]
-                            
-                    prices[sym] = price
-                except Exception as e:
-                    print(f"Error fetching {sym}: {e}")
-                    prices[sym] = 0.0
-        except Exception as e:
-            print(f"Batch fetch error: {e}")
+    rates_map = FX_RATE_SYMBOLS
+    symbols.extend(rates_map.values())
+
+    # 3. Current prices from the shared quote cache. With the background refresher
+    #    running these are local reads; otherwise only missing/stale symbols go to Yahoo.
+    prices = get_quotes(symbols, local_only=ensure_price_refresher())
 
     # Extract Rates
     usd_to_brl = prices.get(rates_map['BRL'], 5.0) 
@@ -165,7 +212,9 @@ def fetch_portfolio(user_id, family_id=None):
         "exchange_rate_usd_pln": usd_to_pln,
         "investments": enriched_investments
     }
-    _portfolio_cache[cache_key] = {'data': result, 'ts': time.time()}
+    with _portfolio_lock:
+        if _portfolio_generation.get(cache_key, 0) == generation:
+            _portfolio_cache[cache_key] = {'data': result, 'ts': time.time(), 'version': version}
     return result
 
 def add_investment(user_id, data, family_id=None):
@@ -183,19 +232,23 @@ def add_investment(user_id, data, family_id=None):
     if family_id:
         payload["family_id"] = family_id
     res = client.from_("investments").insert(payload).execute()
+    _invalidate_portfolio_cache(user_id, family_id)
     return res.data
 
-def update_investment(inv_id, user_id, data):
-    _invalidate_portfolio_cache(user_id)
+def update_investment(inv_id, user_id, data, family_id=None):
+    _invalidate_portfolio_cache(user_id, family_id)
     client = get_pg()
     # Security check: policy handles it, but good to be explicit
     res = client.from_("investments").update(data).eq("id", inv_id).eq("user_id", user_id).execute()
+    # Again after the write: a valuation started in between would have read the old row
+    _invalidate_portfolio_cache(user_id, family_id)
     return res.data
 
-def delete_investment(inv_id, user_id):
-    _invalidate_portfolio_cache(user_id)
+def delete_investment(inv_id, user_id, family_id=None):
+    _invalidate_portfolio_cache(user_id, family_id)
     client = get_pg()
     res = client.from_("investments").delete().eq("id", inv_id).eq("user_id", user_id).execute()
+    _invalidate_portfolio_cache(user_id, family_id)
     return res.data
 
 def get_portfolio_distribution_by_type(user_id, investment_types=None, family_id=None):
@@ -0,0 +1,129 @@
+"""
+Keeps the shared quote cache current in the background, so portfolio requests
+read local prices instead of waiting on Yahoo.
+
+Every PRICE_REFRESH_SECONDS the thread re-prices the union of symbols held in
+any investment (re-read every PRICE_SYMBOLS_RELOAD_SECONDS), plus the FX pairs
+and anything already in the quote cache, in batches of PRICE_REFRESH_CHUNK.
+Each batch gets its own fetch deadline, and the starting point rotates every
+cycle, so a slow batch cannot keep starving the same symbols. Cycles that
+price nothing back off exponentially up to PRICE_REFRESH_MAX_BACKOFF.
+
+Off by default: every process running it prices every tenant's symbols, so
+Yahoo traffic would grow with the worker count. Set PRICE_REFRESHER=1 on one
+process (as with PREMATERIALIZE_SCHEDULER); it then starts on first use there,
+and the other workers fetch missing or stale quotes on demand.
+"""
+import os
+import time
+import threading
+from datetime import datetime
+from service.database import get_pg
+from service.quote_cache import fetch_quotes_coalesced, store_quotes, cached_symbols, FX_RATE_SYMBOLS
+
+PRICE_REFRESHER_ENABLED = os.environ.get("PRICE_REFRESHER", "").lower() in ("1", "true", "yes")
+PRICE_REFRESH_SECONDS = int(os.environ.get("PRICE_REFRESH_SECONDS", "60"))
+PRICE_REFRESH_MAX_BACKOFF = int(os.environ.get("PRICE_REFRESH_MAX_BACKOFF", "1800"))
+PRICE_SYMBOLS_RELOAD_SECONDS = int(os.environ.get("PRICE_SYMBOLS_RELOAD_SECONDS", "600"))
+PRICE_REFRESH_CHUNK = max(1, int(os.environ.get("PRICE_REFRESH_CHUNK", "20")))
+
+_refresher_thread = None
+_start_lock = threading.Lock()
+_stop_event = threading.Event()
+_rotation = 0
+_status = {
+    "tracked_symbols": 0,
+    "last_success_at": None,
+    "last_error": None,
+    "consecutive_failures": 0,
+    "next_delay_s": None,
+}
+
+
+def load_tracked_symbols():
+    """Union of the market symbols held in any investment."""
+    rows = get_pg().from_("investments")\
+        .select("symbol")\
+        .in_("type", ["stock", "crypto"])\
+        .not_.is_("symbol", "null")\
+        .execute().data or []
+    return {r["symbol"] for r in rows if r["symbol"]}
+
+
+def _refresh_chunks(symbols):
+    """`symbols` in PRICE_REFRESH_CHUNK batches, starting one batch further along each call."""
+    global _rotation
+    ordered = sorted(symbols)
+    if not ordered:
+        return []
+    start = _rotation % len(ordered)
+    _rotation = start + PRICE_REFRESH_CHUNK
+    ordered = ordered[start:] + ordered[:start]
+    return [ordered[i:i + PRICE_REFRESH_CHUNK] for i in range(0, len(ordered), PRICE_REFRESH_CHUNK)]
+
+
+def refresh_once(symbols):
+    """Fetches `symbols` batch by batch and publishes the prices. Raises when nothing could be priced."""
+    priced = {}
+    for chunk in _refresh_chunks(symbols):
+        started = time.time()
+        prices = fetch_quotes_coalesced(chunk)
+        chunk_priced = {sym: price for sym, price in prices.items() if price and price > 0}
+        # Unpriced symbols keep their last known quote
+        store_quotes(chunk_priced, fetched_at=started)
+        priced.update(chunk_priced)
+    if not priced:
+        raise RuntimeError(f"no prices returned for {len(symbols)} symbols")
+    return priced
+
+
+def _refresher_loop():
+    tracked = set()
+    tracked_loaded_at = 0.0
+    failures = 0
+    while not _stop_event.is_set():
+        try:
+            if time.time() - tracked_loaded_at >= PRICE_SYMBOLS_RELOAD_SECONDS:
+                tracked = load_tracked_symbols()
+                tracked_loaded_at = time.time()
+            symbols = tracked | set(cached_symbols()) | set(FX_RATE_SYMBOLS.values())
+            _status["tracked_symbols"] = len(symbols)
+            refresh_once(symbols)
+            failures = 0
+            _status["last_success_at"] = datetime.utcnow().isoformat()
+            _status["last_error"] = None
+        except Exception as e:
+            failures += 1
+            _status["last_error"] = str(e)
+            print(f"[WARN] Price refresh failed ({failures} in a row): {e}")
+        _status["consecutive_failures"] = failures
+        delay = min(PRICE_REFRESH_SECONDS * (2 ** failures), PRICE_REFRESH_MAX_BACKOFF)
+        _status["next_delay_s"] = delay
+        _stop_event.wait(delay)
+
+
+def ensure_price_refresher():
+    """
+    Starts the refresher in this process if enabled and not running (idempotent).
+    Returns True when prices are being kept current in the background.
+    """
+    global _refresher_thread
+    if not PRICE_REFRESHER_ENABLED:
+        return False
+    if _refresher_thread is not None and _refresher_thread.is_alive():
+        return True
+    with _start_lock:
+        if _refresher_thread is None or not _refresher_thread.is_alive():
+            _stop_event.clear()
+            _refresher_thread = threading.Thread(target=_refresher_loop, name="price-refresher", daemon=True)
+            _refresher_thread.start()
+    return True
+
+
+def stop_price_refresher():
+    _stop_event.set()
+
+
+def get_price_refresher_status():
+    running = _refresher_thread is not None and _refresher_thread.is_alive()
+    return {"enabled": PRICE_REFRESHER_ENABLED, "running": running, **_status}
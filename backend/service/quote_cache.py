@@ -0,0 +1,298 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import yfinance as yf
+from service.cache import TTLCache
+
+# Per-symbol quotes shared by every family: a portfolio valuation only goes to
+# Yahoo for symbols nobody has fetched recently, all in one yf.Tickers batch.
+# The background refresher (service.price_refresher) publishes here too.
+QUOTE_CACHE_SIZE = int(os.environ.get("QUOTE_CACHE_SIZE", "5000"))
+# A quote is fresh for this long...
+QUOTE_CACHE_TTL = int(os.environ.get("QUOTE_CACHE_TTL", "120"))
+FX_QUOTE_TTL = int(os.environ.get("FX_QUOTE_TTL", "900"))
+# ...and kept (as a last known price) for this long
+QUOTE_MAX_AGE = int(os.environ.get("QUOTE_MAX_AGE", "21600"))
+# Symbols Yahoo returned no price for are retried after this long
+QUOTE_FAILURE_TTL = 60
+
+# Per-symbol pricing runs in a bounded pool. A symbol is given up on after
+# QUOTE_SYMBOL_TIMEOUT seconds and a whole batch after QUOTE_FETCH_DEADLINE;
+# symbols failing QUOTE_BREAKER_THRESHOLD times in a row are skipped for
+# QUOTE_BREAKER_COOLDOWN seconds (their last known price is used meanwhile).
+QUOTE_FETCH_WORKERS = int(os.environ.get("QUOTE_FETCH_WORKERS", "8"))
+QUOTE_SYMBOL_TIMEOUT = float(os.environ.get("QUOTE_SYMBOL_TIMEOUT", "4"))
+QUOTE_FETCH_DEADLINE = float(os.environ.get("QUOTE_FETCH_DEADLINE", "10"))
+QUOTE_BREAKER_THRESHOLD = int(os.environ.get("QUOTE_BREAKER_THRESHOLD", "3"))
+QUOTE_BREAKER_COOLDOWN = int(os.environ.get("QUOTE_BREAKER_COOLDOWN", "600"))
+
+# Currency -> Yahoo FX pair used to convert it. Every portfolio needs all of them.
+# BRL=X -> USD to BRL (e.g. 5.15)
+# EURUSD=X -> EUR to USD (e.g. 1.05)
+# USDPLN=X -> USD to PLN (e.g. 3.95)
+FX_RATE_SYMBOLS = {
+    'BRL': 'BRL=X',
+    'EUR': 'EURUSD=X',
+    'PLN': 'USDPLN=X'
+}
+_FX_SYMBOLS = frozenset(FX_RATE_SYMBOLS.values())
+
+# symbol -> (price, fetched_at)
+_quote_cache = TTLCache(maxsize=QUOTE_CACHE_SIZE, ttl=QUOTE_MAX_AGE)
+_stats_lock = threading.Lock()
+_outbound_batches = 0
+_symbols_fetched = 0
+_symbols_coalesced = 0
+
+# symbol -> the in-flight batch fetching it, so concurrent callers join it
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+class _Batch:
+    def __init__(self):
+        self.done = threading.Event()
+        self.prices = {}
+
+
+# Abandoned (timed-out) lookups keep their worker until Yahoo answers; the
+# breaker stops the same symbol from tying up more of them.
+_fetch_pool = ThreadPoolExecutor(max_workers=QUOTE_FETCH_WORKERS, thread_name_prefix="quote-fetch")
+
+# symbol -> failures (consecutive), open_until, calls, timeouts, last_s, max_s
+_symbol_health = {}
+_health_lock = threading.Lock()
+
+
+def _health(sym):
+    return _symbol_health.setdefault(sym, {
+        "failures": 0, "open_until": 0.0, "calls": 0, "timeouts": 0, "last_s": None, "max_s": 0.0,
+    })
+
+
+def _breaker_open(sym, now):
+    with _health_lock:
+        h = _symbol_health.get(sym)
+        return h is not None and h["open_until"] > now
+
+
+def _record_attempt(sym, ok, duration, timed_out=False):
+    with _health_lock:
+        h = _health(sym)
+        h["calls"] += 1
+        h["last_s"] = round(duration, 3)
+        h["max_s"] = max(h["max_s"], h["last_s"])
+        if timed_out:
+            h["timeouts"] += 1
+        if ok:
+            h["failures"] = 0
+            h["open_until"] = 0.0
+        else:
+            h["failures"] += 1
+            if h["failures"] >= QUOTE_BREAKER_THRESHOLD:
+                h["open_until"] = time.time() + QUOTE_BREAKER_COOLDOWN
+                print(f"[WARN] Quote circuit open for {sym} after {h['failures']} failures "
+                      f"(skipping for {QUOTE_BREAKER_COOLDOWN}s)")
+
+
+def _price_ticker(ticker):
+    # Try fast_info first, then history
+    price = 0.0
+    if hasattr(ticker, 'fast_info'):
+        # safe access
+        try:
+            price = ticker.fast_info['last_price']
+        except:
+            pass
+
+    if price == 0.0:
+        hist = ticker.history(period="1d")
+        if not hist.empty:
+            price = hist['Close'].iloc[-1]
+    return price
+
+
+def fetch_quotes_from_yahoo(symbols):
+    """
+    Prices `symbols` concurrently (one yf.Tickers batch, one pool task per
+    symbol). Symbols without a price, timed out or behind an open circuit
+    breaker map to 0.0.
+    """
+    prices = {}
+    if not symbols:
+        return prices
+    now = time.time()
+    symbols = set(symbols) # Unique
+    skipped = {sym for sym in symbols if _breaker_open(sym, now)}
+    prices.update({sym: 0.0 for sym in skipped})
+    live = sorted(symbols - skipped)
+    if not live:
+        return prices
+
+    try:
+        data = yf.Tickers(" ".join(live))
+    except Exception as e:
+        print(f"Batch fetch error: {e}")
+        return prices
+
+    started = {}
+
+    def price_symbol(sym):
+        started[sym] = time.time()
+        return _price_ticker(data.tickers[sym])
+
+    futures = {_fetch_pool.submit(price_symbol, sym): sym for sym in live}
+    pending = set(futures)
+    deadline = now + QUOTE_FETCH_DEADLINE
+    while pending and time.time() < deadline:
+        done, pending = wait(pending, timeout=min(deadline - time.time(), 0.25), return_when=FIRST_COMPLETED)
+        for future in done:
+            sym = futures[future]
+            try:
+                price = future.result()
+            except Exception as e:
+                print(f"Error fetching {sym}: {e}")
+                price = 0.0
+            prices[sym] = price
+            _record_attempt(sym, bool(price and price > 0), time.time() - started.get(sym, now))
+
+        # Per-symbol deadline: stop waiting for lookups running too long
+        t = time.time()
+        for future in [f for f in pending if futures[f] in started and t - started[futures[f]] > QUOTE_SYMBOL_TIMEOUT]:
+            pending.discard(future)
+            sym = futures[future]
+            prices[sym] = 0.0
+            _record_attempt(sym, False, t - started[sym], timed_out=True)
+
+    # Overall deadline: give up on the rest (never-started ones are not the symbol's fault)
+    for future in pending:
+        sym = futures[future]
+        prices[sym] = 0.0
+        if not future.cancel() and sym in started:
+            _record_attempt(sym, False, time.time() - started[sym], timed_out=True)
+    if pending:
+        print(f"[WARN] Quote batch deadline ({QUOTE_FETCH_DEADLINE}s) hit with {len(pending)} symbols outstanding")
+    return prices
+
+
+def fetch_quotes_coalesced(symbols):
+    """
+    fetch_quotes_from_yahoo() with per-symbol single-flight: symbols already
+    being fetched by another thread are awaited instead of requested again;
+    the rest go out as one batch.
+    """
+    global _outbound_batches, _symbols_fetched, _symbols_coalesced
+    with _inflight_lock:
+        joined = {sym: _inflight[sym] for sym in set(symbols) if sym in _inflight}
+        mine = sorted(set(symbols) - set(joined))
+        batch = _Batch() if mine else None
+        for sym in mine:
+            _inflight[sym] = batch
+
+    prices = {}
+    if mine:
+        try:
+            batch.prices = fetch_quotes_from_yahoo(mine)
+        finally:
+            with _inflight_lock:
+                for sym in mine:
+                    _inflight.pop(sym, None)
+            batch.done.set()
+        prices.update(batch.prices)
+
+    for sym, other in joined.items():
+        other.done.wait()
+        if sym in other.prices:
+            prices[sym] = other.prices[sym]
+
+    with _stats_lock:
+        if mine:
+            _outbound_batches += 1
+            _symbols_fetched += len(mine)
+        _symbols_coalesced += len(joined)
+    return prices
+
+
+def _fresh_for(symbol, price):
+    if not price or price <= 0:
+        return QUOTE_FAILURE_TTL
+    return FX_QUOTE_TTL if symbol in _FX_SYMBOLS else QUOTE_CACHE_TTL
+
+
+def _is_fresh(symbol, entry, now):
+    return now - entry[1] < _fresh_for(symbol, entry[0])
+
+
+def store_quotes(prices, fetched_at=None):
+    """Publishes fetched prices to the shared cache."""
+    fetched_at = fetched_at or time.time()
+    for sym, price in prices.items():
+        ttl = QUOTE_MAX_AGE if price and price > 0 else QUOTE_FAILURE_TTL
+        _quote_cache.set(sym, (price, fetched_at), ttl=ttl)
+
+
+def cached_symbols():
+    """Symbols currently held in the quote cache."""
+    return _quote_cache.keys()
+
+
+def get_quotes(symbols, local_only=False):
+    """
+    Current prices for `symbols`. Fresh cached quotes are reused; the rest are
+    fetched in a single Yahoo batch. FX pairs close to expiry ride along with any
+    batch that goes out anyway, so they rarely need a call of their own.
+    With local_only (the background refresher keeps quotes current), any cached
+    price is used regardless of age and only never-seen symbols are fetched.
+    Symbols Yahoo could not price are absent or 0.0, as with a direct fetch.
+    """
+    now = time.time()
+    entries = {sym: _quote_cache.get(sym) for sym in set(s for s in symbols if s)}
+    usable = {
+        sym: entry for sym, entry in entries.items()
+        if entry is not None and (local_only or _is_fresh(sym, entry, now))
+    }
+    prices = {sym: entry[0] for sym, entry in usable.items()}
+    to_fetch = set(entries) - set(usable)
+
+    if to_fetch:
+        # Stale-but-known prices are the fallback if the fetch fails
+        known = {sym: entry[0] for sym, entry in entries.items() if entry is not None and entry[0]}
+        for sym in _FX_SYMBOLS:
+            entry = entries[sym] if sym in entries else _quote_cache.get(sym)
+            if entry is not None and entry[0]:
+                known.setdefault(sym, entry[0])
+            if not local_only and (entry is None or now - entry[1] > FX_QUOTE_TTL / 2):
+                to_fetch.add(sym)
+        fetched = fetch_quotes_coalesced(to_fetch)
+        # A failed refresh must not replace a known price
+        fetched = {sym: price for sym, price in fetched.items() if price or sym not in known}
+        store_quotes(fetched, fetched_at=now)
+        prices.update({sym: known[sym] for sym in to_fetch & set(entries) if sym in known})
+        prices.update({sym: price for sym, price in fetched.items() if sym in entries})
+    return prices
+
+
+def get_quote_fetch_metrics(limit=10):
+    """Slowest symbols by worst lookup time, and symbols whose circuit breaker is open."""
+    now = time.time()
+    with _health_lock:
+        health = {sym: dict(h) for sym, h in _symbol_health.items()}
+    slowest = sorted(health.items(), key=lambda kv: kv[1]["max_s"], reverse=True)[:limit]
+    return {
+        "slowest": [
+            {"symbol": sym, **{k: v for k, v in h.items() if k != "open_until"}}
+            for sym, h in slowest
+        ],
+        "open_breakers": {
+            sym: round(h["open_until"] - now) for sym, h in health.items() if h["open_until"] > now
+        },
+    }
+
+
+def get_quote_cache_stats():
+    stats = _quote_cache.stats()
+    stats["outbound_batches"] = _outbound_batches
+    stats["symbols_fetched"] = _symbols_fetched
+    stats["symbols_coalesced"] = _symbols_coalesced
+    return stats
@@ -0,0 +1,237 @@
+import os
+import calendar
+from datetime import date
+from dateutil.parser import parse
+from service.database import get_pg
+from service.request_memo import memo_execute
+from service.cache import TTLCache
+from service.billing_service import stamp_billing_periods
+from service.data_version import get_data_version
+
+# Materialization watermarks: a (family, month, year) row in
+# recurring_materialization_watermarks means every active recurring definition
+# of the family already has its expense for that month, so reads can skip
+# materialization. Confirmed watermarks are also cached in-process under the
+# family data version (memoized per request), so a definition written on any
+# worker — which bumps the version — is never hidden by a cached watermark.
+WATERMARK_CACHE_TTL = int(os.environ.get("WATERMARK_CACHE_TTL", "60"))
+_watermark_cache = TTLCache(maxsize=10000, ttl=WATERMARK_CACHE_TTL)
+
+
+def _recurring_target_date(rdef, month, year):
+    """
+    The date a recurring definition materializes on in month/year, or None if
+    that month is before the definition was created.
+    """
+    day = rdef['day_of_month'] or 1
+
+    # Calculate target date, handling end-of-month edge cases (e.g. Feb 31 -> Feb 28/29)
+    last_day = calendar.monthrange(year, month)[1]
+    target_date = date(year, month, min(day, last_day))
+
+    # Don't backdate: only allow expenses for the creation month or later.
+    # e.g. created on March 20 with day_of_month=5 → March 5 IS allowed (same month).
+    created_at_date = parse(rdef['created_at']).date()
+    created_month_start = date(created_at_date.year, created_at_date.month, 1)
+    if target_date < created_month_start:
+        return None
+    return target_date
+
+
+def _materialize_definitions(client, recurring_defs, month, year, family_id=None):
+    """
+    Creates the month's expense for every definition that does not have one yet,
+    as a single upsert. The (recurring_id, recurring_month) unique constraint makes
+    the database skip rows that already exist, so concurrent callers cannot
+    create duplicates. Returns the number of expenses created; failures propagate.
+    """
+    month_start = date(year, month, 1)
+
+    new_expenses = []
+    for rdef in recurring_defs or []:
+        target_date = _recurring_target_date(rdef, month, year)
+        if target_date is None:
+            continue
+        new_exp = {
+            "user_id": rdef['user_id'],
+            "amount": rdef['amount'],
+            "category_key": rdef['category_key'],
+            "payment_method_id": rdef['payment_method_id'],
+            "spent_at": target_date.isoformat(),
+            "recurring_id": rdef['id'],
+            "recurring_month": month_start.isoformat(),
+            "comment": f"Recurring: {rdef['description'] or ''}".strip()
+        }
+        if family_id:
+            new_exp["family_id"] = family_id
+        new_expenses.append(new_exp)
+
+    if not new_expenses:
+        return 0
+    stamp_billing_periods(new_expenses)
+
+    # ON CONFLICT DO NOTHING: only rows that were actually inserted come back
+    res = client.from_("expenses").upsert(
+        new_expenses,
+        on_conflict="recurring_id,recurring_month",
+        ignore_duplicates=True,
+    ).execute()
+    created = len(res.data or [])
+    if created:
+        print(f"[DEBUG] MATERIALIZED: {created} recurring expenses for {month}/{year}")
+    return created
+
+
+def materialize_recurring_expenses(month, year, user_id):
+    """
+    Auto-generates expense records for active recurring definitions.
+    Only creates expenses for months on or after the template creation month.
+    """
+    client = get_pg()
+
+    # Get all active recurring expenses for this user
+    recurring_defs = client.from_("recurring_expenses")\
+        .select("*")\
+        .eq("user_id", user_id)\
+        .eq("active", True)\
+        .execute().data
+    try:
+        return _materialize_definitions(client, recurring_defs, month, year)
+    except Exception as e:
+        print(f"[ERROR] Failed to materialize recurring expenses for user {user_id} in {month}/{year}: {e}")
+        return 0
+
+
+def _cached_data_version(family_id):
+    """The family data version the watermark cache is keyed by; None (don't cache) if unavailable."""
+    try:
+        return get_data_version(family_id)
+    except Exception as e:
+        print(f"[WARN] Data version lookup failed, not caching watermarks: {e}")
+        return None
+
+
+def _missing_watermarks(client, family_id, periods, data_version=None):
+    """
+    The (month, year) periods without a watermark, in order. One query covers
+    every period not already confirmed in the in-process cache.
+    """
+    unknown = [
+        (month, year) for month, year in periods
+        if data_version is None or not _watermark_cache.get((family_id, month, year, data_version))
+    ]
+    if not unknown:
+        return []
+    years = [year for _, year in unknown]
+    res = client.from_("recurring_materialization_watermarks")\
+        .select("month, year")\
+        .eq("family_id", family_id)\
+        .gte("year", min(years))\
+        .lte("year", max(years))\
+        .execute()
+    stored = {(row['month'], row['year']) for row in res.data or []}
+    if data_version is not None:
+        for month, year in stored:
+            _watermark_cache.set((family_id, month, year, data_version), True)
+    return [period for period in unknown if period not in stored]
+
+
+def _definition_generation(client, family_id):
+    """Counter bumped by every recurring_expenses write of the family (0 if never written)."""
+    res = client.from_("recurring_definition_generations")\
+        .select("generation")\
+        .eq("family_id", family_id)\
+        .execute()
+    return res.data[0]["generation"] if res.data else 0
+
+
+def _set_watermark(client, family_id, month, year, generation, data_version=None):
+    """
+    Records the watermark unless a definition changed since `generation` was
+    read (see migrations/add_recurring_watermark_generation.sql). Returns
+    whether it was recorded.
+    """
+    recorded = client.rpc("set_materialization_watermark", {
+        "p_family_id": family_id,
+        "p_month": month,
+        "p_year": year,
+        "p_generation": generation,
+    }).execute().data
+    if recorded and data_version is not None:
+        _watermark_cache.set((family_id, month, year, data_version), True)
+    else:
+        print(f"[DEBUG] Recurring definitions of family {family_id} changed during materialization; no watermark for {month}/{year}")
+    return bool(recorded)
+
+
+def invalidate_materialization_watermarks(family_id):
+    """
+    Forgets that any month is fully materialized for this family. Call whenever
+    a recurring_expenses row is created, updated or deactivated. (The database
+    trigger drops the stored watermarks too; this also clears the local cache.)
+    """
+    if not family_id:
+        return
+    _watermark_cache.discard_where(lambda key, _: key[0] == family_id)
+    get_pg().from_("recurring_materialization_watermarks").delete().eq("family_id", family_id).execute()
+
+
+def materialize_recurring_for_family(month, year, family_id):
+    """
+    Family-wide materialization: one query for every member's active definitions
+    and a single idempotent bulk upsert, regardless of family size or number of
+    recurring definitions. Skipped entirely once the month carries a watermark.
+    """
+    return materialize_recurring_for_family_range([(month, year)], family_id)
+
+
+def materialize_recurring_for_family_range(periods, family_id):
+    """
+    materialize_recurring_for_family() for several (month, year) periods: one
+    watermark query for the whole range, and the definitions are read once for
+    all months still missing one. Returns the number of expenses created.
+    """
+    client = get_pg()
+    data_version = _cached_data_version(family_id)
+    missing = _missing_watermarks(client, family_id, periods, data_version)
+    if not missing:
+        return 0
+
+    # Read before the definitions, so a definition written meanwhile voids the watermark
+    generation = _definition_generation(client, family_id)
+    family_users = memo_execute(client.from_("profiles").select("id").eq("family_id", family_id)).data
+    recurring_defs = []
+    if family_users:
+        recurring_defs = client.from_("recurring_expenses")\
+            .select("*")\
+            .in_("user_id", [user['id'] for user in family_users])\
+            .eq("active", True)\
+            .execute().data
+
+    created = 0
+    for month, year in missing:
+        created += _materialize_definitions(client, recurring_defs, month, year, family_id=family_id)
+        _set_watermark(client, family_id, month, year, generation, data_version)
+    return created
+
+
+def materialize_recurring_for_scope(month, year, user_id=None, family_id=None):
+    """Materializes recurring expenses for everyone whose expenses a period view will show."""
+    client = get_pg()
+    if family_id:
+        # Family-scoped: materialize for all family members in one batch
+        try:
+            materialize_recurring_for_family(month, year, family_id)
+        except Exception as e:
+            print(f"Error materializing for family: {e}")
+    elif user_id:
+        # Fallback: specific user (for backwards compat / single-user case)
+        materialize_recurring_expenses(month, year, user_id)
+    else:
+        # No filter - materialize for all users (should not happen in normal flow)
+        try:
+            all_users = client.from_("profiles").select("id").execute().data
+            for user in all_users:
+                materialize_recurring_expenses(month, year, user['id'])
+        except Exception as e:
+            print(f"Error materializing for all users: {e}")
@@ -0,0 +1,72 @@
+import json
+import asyncio
+import threading
+from flask import g, has_app_context
+
+# Request-scoped memoization of PostgREST reads. Identical reads (same table,
+# filters, ordering and Prefer header) within one request hit PostgREST once;
+# outside a request context queries simply execute. Memoized results are
+# shared, so only use this for reads whose rows the caller does not mutate.
+
+_memo_lock = threading.Lock()
+
+
+def _memo_key(query):
+    # postgrest >= 2 keeps the request on query.request; older versions on the builder itself.
+    # path ends in "/<table>" (or "/rpc/<fn>"), params carries the filters and the
+    # body carries RPC arguments (POST), so it is part of the key too.
+    req = getattr(query, "request", query)
+    body = getattr(req, "json", None)
+    body = json.dumps(body, sort_keys=True, default=str) if body else None
+    return (str(req.path), str(req.http_method), tuple(sorted(req.params.multi_items())), req.headers.get("Prefer"), body)
+
+
+def _memo(name):
+    with _memo_lock:
+        if "pg_memo_hits" not in g:
+            g.pg_memo = {}
+            g.pg_memo_async = {}
+            g.pg_memo_hits = 0
+        return getattr(g, name)
+
+
+def _count_hit():
+    with _memo_lock:
+        g.pg_memo_hits += 1
+
+
+def memo_execute(query):
+    """Executes a read-only PostgREST query, reusing an identical read made earlier in this request."""
+    if not has_app_context():
+        return query.execute()
+    memo = _memo("pg_memo")
+    key = _memo_key(query)
+    if key in memo:
+        _count_hit()
+        return memo[key]
+    res = query.execute()
+    memo[key] = res
+    return res
+
+
+async def memo_execute_async(query):
+    """
+    Async variant of memo_execute(). Concurrent identical reads (e.g. from one
+    gather_queries() call) share a single in-flight request.
+    """
+    if not has_app_context():
+        return await query.execute()
+    memo = _memo("pg_memo_async")
+    key = _memo_key(query)
+    task = memo.get(key)
+    if task is not None:
+        _count_hit()
+    else:
+        task = asyncio.ensure_future(query.execute())
+        memo[key] = task
+    return await asyncio.shield(task)
+
+
+def memo_hits():
+    """Number of PostgREST calls deduplicated in the current request."""
+    return g.get("pg_memo_hits", 0) if has_app_context() else 0
@@ -0,0 +1,67 @@
+"""
+Checks the trigger-maintained monthly_rollups table against the raw expense and
+earning rows (see migrations/create_monthly_rollups.sql).
+
+Runs daily from the scheduler thread, or once from the command line:
+
+    python -m service.rollups          # report drift
+    python -m service.rollups --fix    # report drift and rebuild the rollups
+"""
+import os
+import time
+import argparse
+from collections import deque
+from datetime import datetime
+from service.database import get_pg
+
+ROLLUP_RECONCILE_HOURS = int(os.environ.get("ROLLUP_RECONCILE_HOURS", "24"))
+ROLLUP_RECONCILE_FIX = os.environ.get("ROLLUP_RECONCILE_FIX", "").lower() in ("1", "true", "yes")
+
+_reconcile_log = deque(maxlen=20)
+
+
+def reconcile_rollups(fix=False):
+    """
+    Compares every rollup key with the raw rows. Returns the run log entry;
+    `drift` lists the keys whose total or count disagree. With fix=True the
+    rollups are rebuilt from the raw rows in the same transaction.
+    """
+    started = time.time()
+    drift = get_pg().rpc("reconcile_monthly_rollups", {"p_fix": fix}).execute().data or []
+
+    entry = {
+        "started_at": datetime.utcfromtimestamp(started).isoformat(),
+        "duration_s": round(time.time() - started, 2),
+        "drifted_keys": len(drift),
+        "fixed": fix and bool(drift),
+        "drift": drift[:50],
+    }
+    _reconcile_log.append(entry)
+    if drift:
+        print(f"[WARN] Monthly rollups drifted on {len(drift)} keys"
+              f"{' (rebuilt)' if fix else ''}: {drift[:5]}")
+    else:
+        print(f"[DEBUG] Monthly rollups match raw rows ({entry['duration_s']}s)")
+    return entry
+
+
+def get_reconcile_log():
+    """Most recent reconciliation runs, oldest first."""
+    return list(_reconcile_log)
+
+
+def reconcile_due(now=None):
+    """True when no reconciliation has run in the last ROLLUP_RECONCILE_HOURS."""
+    if not _reconcile_log:
+        return True
+    last = datetime.fromisoformat(_reconcile_log[-1]["started_at"])
+    return ((now or datetime.utcnow()) - last).total_seconds() >= ROLLUP_RECONCILE_HOURS * 3600
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconcile monthly rollups with the raw expense/earning rows.")
+    parser.add_argument("--fix", action="store_true", help="Rebuild the rollups when they drifted")
+    args = parser.parse_args()
+
+    result = reconcile_rollups(fix=args.fix)
+    raise SystemExit(1 if result["drifted_keys"] and not args.fix else 0)
@@ -0,0 +1,123 @@
+"""
+Pre-materializes recurring expenses shortly before each month starts, so the
+first dashboard load of the month does not pay for it. The same thread also
+runs the daily monthly-rollup reconciliation (service.rollups).
+
+Runs as a background thread inside the backend (set PREMATERIALIZE_SCHEDULER=1
+on one process) or once from the command line, e.g. from cron:
+
+    python -m service.scheduler --month 11 --year 2026 --workers 8
+"""
+import os
+import time
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+from dateutil.relativedelta import relativedelta
+from service.database import get_pg
+from service.recurring_service import materialize_recurring_for_family
+from service.rollups import reconcile_rollups, reconcile_due, ROLLUP_RECONCILE_FIX
+
+PREMATERIALIZE_WORKERS = int(os.environ.get("PREMATERIALIZE_WORKERS", "4"))
+PREMATERIALIZE_LEAD_HOURS = int(os.environ.get("PREMATERIALIZE_LEAD_HOURS", "6"))
+SCHEDULER_POLL_SECONDS = int(os.environ.get("SCHEDULER_POLL_SECONDS", "900"))
+
+_run_log = deque(maxlen=50)
+_scheduler_thread = None
+_stop_event = threading.Event()
+
+
+def prematerialize_month(month, year, max_workers=PREMATERIALIZE_WORKERS):
+    """
+    Materializes recurring expenses for every family for month/year, at most
+    `max_workers` families at a time. Returns the run log entry.
+    """
+    started = time.time()
+    families = get_pg().from_("families").select("id").execute().data or []
+
+    created = 0
+    errors = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(materialize_recurring_for_family, month, year, fam['id']): fam['id']
+            for fam in families
+        }
+        for future in as_completed(futures):
+            try:
+                created += future.result()
+            except Exception as e:
+                errors.append({"family_id": futures[future], "error": str(e)})
+
+    entry = {
+        "period": f"{month}/{year}",
+        "started_at": datetime.utcfromtimestamp(started).isoformat(),
+        "duration_s": round(time.time() - started, 2),
+        "families": len(families),
+        "expenses_created": created,
+        "errors": errors,
+    }
+    _run_log.append(entry)
+    print(f"[SCHEDULER] Pre-materialized {entry['period']}: {created} expenses for "
+          f"{len(families)} families in {entry['duration_s']}s ({len(errors)} errors)")
+    return entry
+
+
+def get_run_log():
+    """Most recent pre-materialization runs, oldest first."""
+    return list(_run_log)
+
+
+def _due_period(now):
+    """The (month, year) that should be materialized at `now`: next month once inside the lead window, else this month."""
+    next_month_start = date(now.year, now.month, 1) + relativedelta(months=1)
+    lead_start = datetime(next_month_start.year, next_month_start.month, 1) - timedelta(hours=PREMATERIALIZE_LEAD_HOURS)
+    if now >= lead_start:
+        return next_month_start.month, next_month_start.year
+    return now.month, now.year
+
+
+def _scheduler_loop():
+    last_completed = None
+    while not _stop_event.is_set():
+        period = _due_period(datetime.now())
+        if period != last_completed:
+            try:
+                entry = prematerialize_month(*period)
+                if not entry["errors"]:
+                    last_completed = period
+            except Exception as e:
+                print(f"[SCHEDULER] Pre-materialization for {period[0]}/{period[1]} failed: {e}")
+        if reconcile_due():
+            try:
+                reconcile_rollups(fix=ROLLUP_RECONCILE_FIX)
+            except Exception as e:
+                print(f"[SCHEDULER] Rollup reconciliation failed: {e}")
+        _stop_event.wait(SCHEDULER_POLL_SECONDS)
+
+
+def start_scheduler():
+    """Starts the background pre-materialization thread (idempotent)."""
+    global _scheduler_thread
+    if _scheduler_thread is not None and _scheduler_thread.is_alive():
+        return
+    _stop_event.clear()
+    _scheduler_thread = threading.Thread(target=_scheduler_loop, name="prematerialize-scheduler", daemon=True)
+    _scheduler_thread.start()
+
+
+def stop_scheduler():
+    _stop_event.set()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-materialize recurring expenses for every family.")
+    parser.add_argument("--month", type=int, help="Billing month (default: the currently due month)")
+    parser.add_argument("--year", type=int, help="Billing year (default: the currently due year)")
+    parser.add_argument("--workers", type=int, default=PREMATERIALIZE_WORKERS, help="Families processed concurrently")
+    args = parser.parse_args()
+
+    due_month, due_year = _due_period(datetime.now())
+    result = prematerialize_month(args.month or due_month, args.year or due_year, max_workers=args.workers)
+    raise SystemExit(1 if result["errors"] else 0)
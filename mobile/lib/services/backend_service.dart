@@ -38,6 +38,7 @@ class BackendService {
 
   static final Map<String, DashboardData> _dashboardCache = {};
   static final Map<String, DateTime> _dashboardCacheTime = {};
+  static final Map<String, String> _dashboardEtag = {};
   static const _dashboardHardTtl = Duration(minutes: 2);
 
   static bool hasDashboardCache(int month, int year) =>
@@ -46,6 +47,7 @@ class BackendService {
   static void clearDashboardCache() {
     _dashboardCache.clear();
     _dashboardCacheTime.clear();
+    _dashboardEtag.clear();
   }
 
   Future<DashboardData> getDashboard({
@@ -69,11 +71,26 @@ class BackendService {
       };
       final uri =
           Uri.parse('$baseUrl/dashboard').replace(queryParameters: queryParams);
-      final response = await _withAuth((h) => http.get(uri, headers: h));
+      final etag = cached != null ? _dashboardEtag[cacheKey] : null;
+      final response = await _withAuth((h) => http.get(uri, headers: {
+            ...h,
+            if (etag != null) 'If-None-Match': etag,
+          }));
+      if (response.statusCode == 304 && cached != null) {
+        // Nothing changed on the server: keep the cached data
+        _dashboardCacheTime[cacheKey] = DateTime.now();
+        return cached;
+      }
       if (response.statusCode == 200) {
         final data = DashboardData.fromJson(jsonDecode(response.body));
         _dashboardCache[cacheKey] = data;
         _dashboardCacheTime[cacheKey] = DateTime.now();
+        final newEtag = response.headers['etag'];
+        if (newEtag != null) {
+          _dashboardEtag[cacheKey] = newEtag;
+        } else {
+          _dashboardEtag.remove(cacheKey);
+        }
         return data;
       } else {
         throw Exception('Failed to load dashboard: ${response.body}');